@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+from delta_printer import DeltaPrinter, error, errors
+from common import get_points_wheel
+import find_lr
+import find_correct2
+
+# Benchmarks for the simulator hot paths, every workload is fixed and seeded.
+#
+# Examples:
+#   ./bench.py -o baseline.json
+#   ./bench.py -c baseline.json       <-- fails if any workload is more than 20% slower
+
+def physical_and_logical():
+    logical = DeltaPrinter([120.8, 121.0, 120.5], [61.7, 62.0, 61.9], 0.01, [210.2, 330., 90.], [0.1, -0.2, 0.05])
+    logical.home()
+    physical = DeltaPrinter([121.8, 121.0, 120.1], [62.7, 62.0, 61.5], 0.01, [210., 330.3, 90.])
+    return physical, logical
+
+def random_points(count):
+    rng = np.random.default_rng(42)
+    angles = rng.uniform(0, 2*np.pi, count)
+    dists = 45*np.sqrt(rng.uniform(0, 1, count))
+    return np.column_stack((np.cos(angles)*dists, np.sin(angles)*dists))
+
+# Each workload returns (function to run, number of operations per run)
+
+def ik_single():
+    physical, logical = physical_and_logical()
+    points = random_points(2000).tolist()
+    def run():
+        for x, y in points:
+            logical.move(x, y)
+    return run, len(points)
+
+def fk_single():
+    physical, logical = physical_and_logical()
+    steps = logical.move_many(random_points(2000)).tolist()
+    def run():
+        for s in steps:
+            physical.tower_steps = s
+            physical.nozzle_position()
+    return run, len(steps)
+
+def ik_batch():
+    physical, logical = physical_and_logical()
+    points = random_points(100000)
+    def run():
+        logical.move_many(points)
+    return run, len(points)
+
+def fk_batch():
+    physical, logical = physical_and_logical()
+    steps = logical.move_many(random_points(100000))
+    def run():
+        physical.nozzle_positions(steps)
+    return run, len(steps)
+
+def wheel():
+    physical, logical = physical_and_logical()
+    points = get_points_wheel(45, 5, 15.).tolist()
+    def run():
+        for x, y in points:
+            error(physical, logical, x, y)
+    return run, len(points)
+
+def wheel_batch():
+    physical, logical = physical_and_logical()
+    points = get_points_wheel(45, 5, 15.)
+    def run():
+        errors(physical, logical, points)
+    return run, len(points)
+
+def try_for():
+    observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+    def run():
+        find_lr.try_for(120.7, 62.5, observations, 0.1, True)
+    return run, 1
+
+def try_for_batch():
+    observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+    rs = np.arange(60.0, 70.0, 0.05)
+    ls = np.full(len(rs), 120.7)
+    def run():
+        find_lr.try_for_many(ls, rs, observations, 0.1, True)
+    return run, len(rs)
+
+# per-candidate path, as measured before exhaustive() was batched
+def find_correct2_sweep():
+    points = get_points_wheel(45, 450, 60.)
+    observed = [48.5, 48.9, 48.6, 48.7, 48.8, 48.9]
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            find_correct2.exhaustive(points, [120.8]*3, [61.7]*3, [210., 330., 90.], observed, observed, 3.8, 0.1, 2, scalar=True)
+    return run, 3**5
+
+def find_correct2_sweep_batch():
+    points = get_points_wheel(45, 450, 60.)
+    observed = [48.5, 48.9, 48.6, 48.7, 48.8, 48.9]
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            find_correct2.exhaustive(points, [120.8]*3, [61.7]*3, [210., 330., 90.], observed, observed, 3.8, 0.1, 2)
+    return run, 3**5
+
+workloads = [ik_single, fk_single, ik_batch, fk_batch, wheel, wheel_batch, try_for, try_for_batch, find_correct2_sweep, find_correct2_sweep_batch]
+
+def measure(workload, repeat, min_time):
+    run, ops = workload()
+    run() # warm up
+
+    # best of `repeat` rounds, each round runs for at least min_time
+    best = None
+    for r in range(repeat):
+        count = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            count += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_run = elapsed / count
+        best = per_run if best is None else min(best, per_run)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'ops_per_sec': ops / best, 'seconds_per_run': best, 'ops_per_run': ops, 'peak_bytes': peak}
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulator benchmarks')
+    parser.add_argument('-o','--output',type=str,default=None,help='Write results to JSON file')
+    parser.add_argument('-c','--compare',type=str,default=None,help='Compare with results JSON file from an earlier run')
+    parser.add_argument('-t','--tolerance',type=float,default=0.2,help='Allowed slowdown when comparing, 0.2 is 20%%')
+    parser.add_argument('-n','--repeat',type=int,default=3,help='Rounds per workload, best one counts')
+    parser.add_argument('-m','--min-time',type=float,default=0.2,help='Minimum duration of a round, in seconds')
+    parser.add_argument('-w','--workload',type=str,default=None,help='Comma separated workload names, all by default')
+    args = parser.parse_args()
+
+    selected = workloads if args.workload is None else [w for w in workloads if w.__name__ in args.workload.split(',')]
+    baseline = json.load(open(args.compare))['results'] if args.compare else {}
+
+    results = {}
+    regressions = []
+    print("{0:<22} {1:>14} {2:>12} {3:>10}".format("workload", "ops/sec", "peak KiB", "vs base"))
+    for workload in selected:
+        name = workload.__name__
+        result = measure(workload, args.repeat, args.min_time)
+        results[name] = result
+        ratio = ""
+        if name in baseline:
+            speedup = result['ops_per_sec'] / baseline[name]['ops_per_sec']
+            ratio = "{0:.2f}x".format(speedup)
+            if speedup < 1 - args.tolerance:
+                regressions.append(name)
+        print("{0:<22} {1:>14.1f} {2:>12.1f} {3:>10}".format(name, result['ops_per_sec'], result['peak_bytes']/1024, ratio))
+
+    if args.output:
+        info = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}
+        with open(args.output, 'w') as f:
+            json.dump({'info': info, 'results': results}, f, indent=2)
+
+    if regressions:
+        print("Slower than baseline: " + ", ".join(regressions))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
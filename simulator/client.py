@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import socket
+import argparse
+
+# Client of daemon.py, standard library only so it starts fast.
+# Example: ./client.py '{"op": "warp", "wl": "120", "wr": "62.7"}'
+
+# Sends one request and returns parsed response
+def request(path, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps(message) + "\n").encode())
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibration daemon client')
+    parser.add_argument('request',type=str,help='JSON request')
+    parser.add_argument('-S','--socket',type=str,default='/tmp/mpmd-simulator.sock',help='Unix socket path')
+    args = parser.parse_args()
+
+    response = request(args.socket, json.loads(args.request))
+    print(json.dumps(response))
+    if 'error' in response:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
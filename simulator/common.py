@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import math
+import functools
+
+import numpy as np
+
+from delta_printer import DeltaPrinter, parse_values
+from delta_printer_lean import DeltaPrinterLean
+
+# Shared by the simulation tools: probe point patterns and correct/wrong printer options.
+# Point patterns are (N, 2) arrays, cached per parameters and read-only, copy before changing them.
+
+def frozen(points):
+    points = np.array(points, dtype=float)
+    points.flags.writeable = False
+    return points
+
+# horizontal, vertical and diagonal lines
+@functools.lru_cache(maxsize=None)
+def get_points_square(size):
+    points = [(0, 0)]
+    for x in range(size+1):
+        for y in range(size+1):
+            if x == 0 or x == int(size/2) or x == size or y == 0 or y == size or y == x or y == size - x:
+                points.append((int(x-size/2),int(y-size/2)))
+    return frozen(points)
+
+# center point and rings of points, outer ring first
+@functools.lru_cache(maxsize=None)
+def get_points_wheel(max_dist = 50, scatter_step = 5, angle_step = 15.):
+    points = [(0, 0)]
+    scatter = [x/100 for x in range(100, 5, -scatter_step)]
+    for i in range(len(scatter)):
+        dist = max_dist * scatter[i]
+        for j in range(int(360/angle_step)):
+            r = math.radians(90. + angle_step * j)
+            points.append((math.cos(r) * dist, math.sin(r) * dist))
+    return frozen(points)
+
+# geometry option defaults, shared by every tool
+l_value = "120.8"
+r_value = "61.7"
+s_value = 0.01
+a_value = "210,330,90"
+
+# single printer geometry options, role says which printer it is (e.g. Firmware)
+def add_printer_arguments(parser, role = None):
+    prefix = role + " " if role else ""
+    parser.add_argument('-l','--l-value',type=str,default=l_value,help=(prefix + 'diagonal rod length(s), in mm').capitalize())
+    parser.add_argument('-r','--r-value',type=str,default=r_value,help=(prefix + 'delta radius(es), in mm').capitalize())
+    parser.add_argument('-e','--e-value',type=str,default="0",help=(prefix + 'end stops diff, in mm').capitalize())
+    parser.add_argument('-s','--s-value',type=float,default=s_value,help='Step size, in mm')
+    parser.add_argument('-a','--a-value',type=str,default=a_value,help=(prefix + 'tower angles, in deg').capitalize())
+
+# Returns printer of add_printer_arguments() options, homed
+def printer_from_args(args):
+    printer = DeltaPrinter.from_args(args)
+    printer.home()
+    return printer
+
+# correct (physical) and wrong (firmware-believed) printer geometry options
+def add_geometry_arguments(parser):
+
+    parser.add_argument('-l','--l-value',type=str,default=l_value,help='Correct l-value')
+    parser.add_argument('-r','--r-value',type=str,default=r_value,help='Correct r-value')
+    parser.add_argument('-s','--s-value',type=float,default=s_value,help='Correct step size, in mm')
+    parser.add_argument('-a','--a-value',type=str,default=a_value,help='Correct tower angles, in deg')
+    parser.add_argument('-tl','--tl-value',type=str,default="90",help='Correct tower lean(s), in deg, tl<90 means towers lean outwards')
+
+    parser.add_argument('-wl','--wl-value',type=str,default=l_value,help='Wrong l-value')
+    parser.add_argument('-wr','--wr-value',type=str,default=r_value,help='Wrong r-value')
+    parser.add_argument('-ws','--ws-value',type=float,default=None,help='Wrong step size, in mm')
+    parser.add_argument('-wa','--wa-value',type=str,default=None,help='Wrong tower angles, in deg')
+    parser.add_argument('-we','--we-value',type=str,default="0",help='Wrong endstops')
+
+# Returns (correct, wrong) printers, wrong one is homed.
+# Lean on wrong printer is always 90, i.e. it thinks it's correct
+def printers_from_args(args):
+    if args.ws_value is None:
+        args.ws_value = args.s_value
+    if args.wa_value is None:
+        args.wa_value = args.a_value
+
+    correct = DeltaPrinterLean(parse_values(args.l_value), parse_values(args.r_value), args.s_value, parse_values(args.a_value), [0., 0., 0.], parse_values(args.tl_value))
+    wrong = DeltaPrinter(parse_values(args.wl_value), parse_values(args.wr_value), args.ws_value, parse_values(args.wa_value), parse_values(args.we_value))
+    wrong.home()
+    return correct, wrong
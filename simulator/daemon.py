@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import functools
+import itertools
+import threading
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from delta_printer import errors
+from common import get_points_wheel, add_geometry_arguments, printers_from_args
+from sweep import sweep, f_range, ignore_interrupt
+import find_lr
+import find_correct
+
+# Calibration daemon, keeps printers, point patterns and inverse kinematics in memory between calls
+# and answers JSON requests on a Unix socket, one request/response object per line:
+#   {"id": 1, "op": "warp", "wl": "120", "wr": "62.7", "pattern": "heatmaps"}
+#   {"id": 1, "result": {"titles": ["X", "Y", "Z"], "data": [[[x, y, value], ...], ...]}}
+#
+# Requests:
+#   ping                                  - "pong"
+#   warp     geometry, pattern            - sim_warp results, pattern is "wheel" or "heatmaps"
+#   errors   geometry, points             - nozzle error [dx, dy, dz] at [x, y] points, null if unreachable
+#   sweep    tool, observations, s, f     - starts find_lr/find_correct sweep, returns job id
+#   progress job, since                   - sweep state and matches (from index `since` on), a finished job
+#                                           is dropped once its final state is read
+#   cancel   job                          - stops sweep
+#   stats                                 - cache statistics
+# Geometry keys are sim_warp options without dashes (l, r, s, a, tl, wl, wr, ws, wa, we), values as on command line.
+#
+# Requests are computed on a thread pool, sweeps share one process pool started with forkserver,
+# worker processes are not forked from a process running threads. At most `kept` finished jobs are
+# kept for unread results, oldest are dropped first.
+#
+# Examples:
+#   ./daemon.py -S /tmp/mpmd.sock &
+#   ./client.py -S /tmp/mpmd.sock '{"op": "errors", "wl": "120", "points": [[0, 50], [0, -50]]}'
+
+geometry_keys = ['l', 'r', 's', 'a', 'tl', 'wl', 'wr', 'ws', 'wa', 'we']
+
+class RequestError(Exception):
+    pass
+
+geometry_parser = argparse.ArgumentParser(add_help=False)
+add_geometry_arguments(geometry_parser)
+
+# (correct, wrong) printers per geometry options, wrong one is homed; printers are shared between
+# threads so only batch methods, that do not change printer state, are used on them
+@functools.lru_cache(maxsize=256)
+def printers(options):
+    try:
+        args = geometry_parser.parse_args([v for key, value in options for v in ('-' + key, value)])
+    except SystemExit:
+        raise RequestError("Bad geometry options")
+    return printers_from_args(args)
+
+# inverse kinematics of the wrong printer and center error, per geometry options and point pattern
+@functools.lru_cache(maxsize=256)
+def steps_for(options, pattern):
+    correct, wrong = printers(options)
+    points = get_points_wheel(*pattern)
+    steps = wrong.move_many(points)
+    steps.flags.writeable = False
+    center = correct.nozzle_positions(wrong.move_many([[0, 0]]))[0][0]
+    return points, steps, center
+
+# request geometry values are numbers, lists of per-tower numbers or command line strings
+def geometry_options(request):
+    options = []
+    for key in geometry_keys:
+        if key in request:
+            value = request[key]
+            values = [str(v) for v in value] if isinstance(value, list) else str(value).split(",")
+            # "#" instead of leading "-", as on command line
+            options.append((key, ",".join("#" + v[1:] if v.startswith("-") else v for v in values)))
+    return tuple(options)
+
+def rows(values):
+    return [[None if np.isnan(v) else round(float(v), 6) for v in row] for row in values]
+
+def warp(request):
+    options = geometry_options(request)
+    correct, wrong = printers(options)
+    heatmaps = request.get('pattern', 'wheel') == 'heatmaps'
+    points, steps, center = steps_for(options, (45, 5, 15.) if heatmaps else (45, 100, 60.))
+    nozzle_positions = correct.nozzle_positions(steps)[0]
+    if heatmaps:
+        err = nozzle_positions - np.hstack((points, np.full((len(points), 1), center[2])))
+        return {'titles': ["X", "Y", "Z"], 'data': [rows(np.column_stack((points, err[:,i]))) for i in range(3)]}
+    return {'titles': ["COORDS"], 'data': [rows(nozzle_positions)]}
+
+def point_errors(request):
+    options = geometry_options(request)
+    correct, wrong = printers(options)
+    points = np.asarray(request.get('points', [[0, 0]]), dtype=float)
+    if points.ndim != 2 or points.shape[1] not in (2, 3):
+        raise RequestError("Points shall be [x, y] pairs")
+    center = steps_for(options, (45, 100, 60.))[2]
+    nozzle_positions, valid = errors(correct, wrong, points[:,0:2])
+    err = nozzle_positions - np.hstack((points[:,0:2], np.full((len(points), 1), center[2])))
+    return {'errors': [row if ok else None for row, ok in zip(rows(err), valid)]}
+
+class Jobs:
+
+    def __init__(self, kept = 64):
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.kept = kept
+        self.workers = os.cpu_count() or 1
+        self.executor = None
+
+    # process pool for sweeps, started on first sweep
+    def pool(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'), initializer=ignore_interrupt)
+            return self.executor
+
+    def prune(self):
+        with self.lock:
+            finished = [job for job in self.jobs.values() if 'finished' in job]
+            for job in sorted(finished, key=lambda job: job['finished'])[:max(0, len(finished) - self.kept)]:
+                del self.jobs[job['id']]
+
+    def start(self, request):
+        tool = {'find_lr': find_lr, 'find_correct': find_correct}.get(request.get('tool', 'find_lr'))
+        if tool is None:
+            raise RequestError("Unknown tool")
+        if not request.get('observations'):
+            raise RequestError("Observations shall be provided")
+        observations = [x.split(",") for x in request['observations'].split(";")]
+        step = float(request.get('s', 0.05))
+        if tool is find_lr:
+            params = dict(observations=observations, error_treshold=0.1, filter_for_flattness=int(request.get('f', 1)) == 1)
+        else:
+            params = dict(observations=observations, error_treshold=0.2, verbose=False)
+        l_values = list(f_range(*tool.l_range, step))
+        r_values = list(f_range(*tool.r_range, step))
+
+        self.prune()
+        executor = self.pool()
+        job = {'id': next(self.ids), 'state': 'running', 'rows': 0, 'total': len(l_values), 'matches': [], 'cancel': False, 'started': time.time()}
+        with self.lock:
+            self.jobs[job['id']] = job
+
+        def run():
+            results = sweep(functools.partial(tool.try_for, **params), l_values, r_values, tool.match_limit, batch=functools.partial(tool.try_for_many, **params), executor=executor)
+            try:
+                for l, matches in results:
+                    job['matches'].extend([l, r, e] for l, r, e in matches)
+                    job['rows'] += 1
+                    if job['cancel']:
+                        job['state'] = 'cancelled'
+                        break
+                else:
+                    job['state'] = 'done'
+            except Exception as e:
+                job['state'] = 'failed'
+                job['error'] = str(e)
+            finally:
+                results.close()
+                job['finished'] = time.time()
+
+        threading.Thread(target=run, daemon=True).start()
+        return {'job': job['id']}
+
+    def get(self, request):
+        job = self.jobs.get(request.get('job'))
+        if job is None:
+            raise RequestError("Unknown job")
+        return job
+
+    def progress(self, request):
+        job = self.get(request)
+        since = int(request.get('since', 0))
+        result = {key: job[key] for key in ['id', 'state', 'rows', 'total', 'started'] if key in job}
+        result['matches'] = job['matches'][since:]
+        result['error'] = job.get('error')
+        if 'finished' in job:
+            with self.lock:
+                self.jobs.pop(job['id'], None)
+        return result
+
+    def cancel(self, request):
+        job = self.get(request)
+        job['cancel'] = True
+        return {'job': job['id']}
+
+jobs = Jobs()
+
+def stats(request):
+    return {'printers': printers.cache_info()._asdict(), 'steps': steps_for.cache_info()._asdict(), 'patterns': get_points_wheel.cache_info()._asdict(), 'jobs': len(jobs.jobs)}
+
+operations = {
+    'ping': lambda request: "pong",
+    'warp': warp,
+    'errors': point_errors,
+    'sweep': jobs.start,
+    'progress': jobs.progress,
+    'cancel': jobs.cancel,
+    'stats': stats,
+}
+
+async def handle(reader, writer, pool):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response = {}
+            try:
+                request = json.loads(line)
+                response['id'] = request.get('id')
+                operation = operations.get(request.get('op'))
+                if operation is None:
+                    raise RequestError("Unknown op")
+                response['result'] = await loop.run_in_executor(pool, operation, request)
+            except Exception as e:
+                response['error'] = str(e)
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(path, threads):
+    pool = ThreadPoolExecutor(max_workers=threads)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(functools.partial(handle, pool=pool), path, limit=1 << 24)
+    print("Listening on " + path, file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibration daemon')
+    parser.add_argument('-S','--socket',type=str,default='/tmp/mpmd-simulator.sock',help='Unix socket path')
+    parser.add_argument('-t','--threads',type=int,default=4,help='Request worker threads')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='Sweep worker processes, shared by all sweeps, defaults to number of cores')
+    args = parser.parse_args()
+    jobs.workers = args.jobs or jobs.workers
+
+    # stopped by SIGTERM as by Ctrl-C, sweep workers are shut down on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(serve(args.socket, args.threads))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if jobs.executor is not None:
+            jobs.executor.shutdown(cancel_futures=True)
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,145 @@
 #!/usr/bin/env python3
 
-import sys
+import math
 import argparse
 
-from numpy import sqrt, dot, cross, array, zeros, radians, cos, sin, tan, pi
-from numpy.linalg import norm
+from collections import OrderedDict
+
+from numpy import sqrt, array, zeros, radians, cos, sin, pi
+from numpy import asarray, rint, errstate, nan, where, eye, empty, concatenate, broadcast_arrays
+from numpy.linalg import solve
 #from numpy import cos, sin, radians
 
-# FIXME tower lean does not work correctly
+# Per-tower option value, "120.8" means the same value for every tower, "120.8,121,120.9" one per tower,
+# "#" can be used instead of leading "-" (argparse takes "-0.1" for an option)
+def parse_values(value, count = 3):
+    value = value.replace("#", "-")
+    return [float(v) for v in value.split(',')] if "," in value else [float(value) for x in range(count)]
+
+# LRU cache of move() results, keyed by printer geometry and nozzle position,
+# shared between printers with the same geometry
+class MoveCache:
+
+    def __init__(self, maxsize = 65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        steps = self.entries.get(key)
+        if steps is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return steps
+
+    def put(self, key, steps):
+        self.entries[key] = steps
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+move_cache = MoveCache()
+
+# Immutable printer geometry, hashable and comparable by value, with per-tower terms pre-calculated
+class DeltaGeometry:
+
+    __slots__ = ('lengths', 'radii', 'step_size', 'angles', 'endstops', 'lengths2', 'tower_xy', 'endstop_steps', '_hash')
+
+    def __init__(self, lengths, radii, step_size = 0.01, angles = (210., 330., 90.), endstops = 0.):
+        lengths = tuple(float(l) for l in lengths) if isinstance(lengths, (list, tuple)) else (float(lengths),)*3
+        radii = tuple(float(r) for r in radii) if isinstance(radii, (list, tuple)) else (float(radii),)*3
+        endstops = tuple(float(e) for e in endstops) if isinstance(endstops, (list, tuple)) else (float(endstops),)*3
+        angles = tuple(float(a) for a in angles)
+        set = object.__setattr__
+        set(self, 'lengths', lengths)
+        set(self, 'radii', radii)
+        set(self, 'step_size', float(step_size))
+        set(self, 'angles', angles)
+        set(self, 'endstops', endstops)
+        set(self, 'lengths2', tuple(l**2 for l in lengths))
+        set(self, 'tower_xy', tuple((math.cos(math.radians(a)) * radii[idx], math.sin(math.radians(a)) * radii[idx]) for idx, a in enumerate(angles)))
+        set(self, 'endstop_steps', tuple(e/step_size for e in endstops))
+        set(self, '_hash', hash((lengths, radii, step_size, angles, endstops)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DeltaGeometry is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DeltaGeometry is immutable")
+
+    def key(self):
+        return (self.lengths, self.radii, self.step_size, self.angles, self.endstops)
+
+    def __eq__(self, other):
+        return isinstance(other, DeltaGeometry) and self.key() == other.key()
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (DeltaGeometry, self.key())
+
+    def __repr__(self):
+        return "DeltaGeometry(lengths={0}, radii={1}, step_size={2}, angles={3}, endstops={4})".format(*self.key())
+
 # TODO Support different L/R per tower
-# TODO Support different lean and step_size per tower
+# TODO Support different step_size per tower
 class DeltaPrinter:
-    
+
+    # set to a MoveCache (e.g. move_cache) to memoize move()
+    cache = None
+
     @classmethod
     def from_args(cls, args):
-        lengths = [float(l) for l in args.l_value.split(',')] if "," in args.l_value else [float(args.l_value) for x in range(3)]
-        radii = [float(r) for r in args.r_value.split(',')] if "," in args.r_value else [float(args.r_value) for x in range(3)]
-        angles = [float(a) for a in args.a_value.split(',')]
-        endstops = [float(e) for e in args.e_value.split(',')] if "," in args.e_value else [float(args.e_value) for x in range(3)]
-        return cls(lengths, radii, args.s_value, angles, endstops)
+        return cls(parse_values(args.l_value), parse_values(args.r_value), args.s_value, parse_values(args.a_value), parse_values(args.e_value))
+
+    @classmethod
+    def from_geometry(cls, geometry):
+        return cls(list(geometry.lengths), list(geometry.radii), geometry.step_size, list(geometry.angles), list(geometry.endstops))
 
     def __init__(self, length, radius, step_size = 0.01, angles = [210., 330., 90.], endstops = 0.):
-        
+
         # geometry
-        self.l = length if type(length) is list else [length, length, length]
-        self.r = radius if type(radius) is list else [radius, radius, radius]
-        self.endstops = endstops if type(endstops) is list else [endstops, endstops, endstops]
-        self.step_size = step_size
-        self.tower_angles = angles
+        self.geometry = DeltaGeometry(length, radius, step_size, angles, endstops)
 
         # must home first
         self.tower_steps = [None, None, None]
 
-        # pre-calc
-        self.tower_coords = [(cos(radians(angle)) * self.r[idx], sin(radians(angle)) * self.r[idx]) for idx, angle in enumerate(self.tower_angles)]
+    # Geometry values are read-only views of self.geometry, move() and the move() cache key
+    # use the geometry, a printer with other values is a new printer (from_geometry())
+    @property
+    def l(self):
+        return self.geometry.lengths
+
+    @property
+    def r(self):
+        return self.geometry.radii
+
+    @property
+    def endstops(self):
+        return self.geometry.endstops
+
+    @property
+    def step_size(self):
+        return self.geometry.step_size
+
+    @property
+    def tower_angles(self):
+        return self.geometry.angles
+
+    @property
+    def tower_coords(self):
+        return self.geometry.tower_xy
+
+    def fingerprint(self):
+        return self.geometry
 
     def home(self):
         self.move(0,0,0,True)
@@ -45,39 +151,87 @@ class DeltaPrinter:
     def move(self, x, y, z = 0, force = False):
         if self.tower_steps[0] is None and not force:
             raise Exception("Must home first")
+        if self.cache is not None:
+            key = (self.fingerprint(), x, y, z)
+            steps = self.cache.get(key)
+            if steps is not None:
+                self.tower_steps = list(steps)
+                return
+        g = self.geometry
         for tower in [0, 1, 2]:
-            tx = self.tower_coords[tower][0]
-            ty = self.tower_coords[tower][1]
-            tz = sqrt(self.l[tower]**2 - (tx-x)**2 - (ty-y)**2) + z
-            self.tower_steps[tower] = round(tz/self.step_size) + self.endstops[tower]/self.step_size
+            tx, ty = g.tower_xy[tower]
+            tz = sqrt(g.lengths2[tower] - (tx-x)**2 - (ty-y)**2) + z
+            self.tower_steps[tower] = round(tz/g.step_size) + g.endstop_steps[tower]
+        if self.cache is not None:
+            self.cache.put(key, tuple(self.tower_steps))
+
+    # Batch version of move(), points is (N,3) or (N,2) array of nozzle coordinates,
+    # returns (N,3) array of tower steps, NaN where a point is out of reach.
+    # Printer state (tower_steps) is not changed.
+    def move_many(self, points, force = False):
+        if self.tower_steps[0] is None and not force:
+            raise Exception("Must home first")
+        points = asarray(points, dtype=float)
+        x = points[:,0,None]
+        y = points[:,1,None]
+        z = points[:,2,None] if points.shape[1] > 2 else 0.
+        g = self.geometry
+        tx, ty = array(g.tower_xy).T
+        with errstate(invalid='ignore'):
+            tz = sqrt(array(g.lengths2) - (tx-x)**2 - (ty-y)**2) + z
+        return rint(tz/g.step_size) + array(g.endstop_steps)
+
+    # Carriage speeds per unit of nozzle speed, the derivative of move() carriage heights (before rounding to steps)
+    # along directions. points is (N,2) array, directions is (D,2) array of unit vectors,
+    # returns (N,D,3) array, NaN where a point is out of reach. Printer state is not used.
+    def carriage_speeds(self, points, directions):
+        points = asarray(points, dtype=float)
+        directions = asarray(directions, dtype=float)
+        g = self.geometry
+        tx, ty = array(g.tower_xy).T
+        dx = tx - points[:,0,None]
+        dy = ty - points[:,1,None]
+        with errstate(invalid='ignore', divide='ignore'):
+            tz = sqrt(array(g.lengths2) - dx**2 - dy**2)
+            # d/ds sqrt(l^2 - (tx-x)^2 - (ty-y)^2) = ((tx-x)*ux + (ty-y)*uy) / sqrt(...)
+            return (dx[:,None,:]*directions[None,:,0,None] + dy[:,None,:]*directions[None,:,1,None]) / tz[:,None,:]
 
     def carriage_position(self, tower):
-        _x = self.tower_coords[tower][0]
-        _y = self.tower_coords[tower][1]
-        _z = self.tower_steps[tower]*self.step_size
-        return array([_x, _y, _z])
+        return array(self.carriage_coords(tower))
+
+    # carriage position as plain (x, y, z) floats
+    # Endstops are where the printer believes its endstops are: move() adds them to tower steps, and a carriage
+    # ends up that much lower than its steps say, so a printer driven by itself (or by the same geometry) has no error
+    # and the difference of physical and logical endstops shifts carriages.
+    def carriage_coords(self, tower):
+        g = self.geometry
+        x, y = g.tower_xy[tower]
+        return x, y, (self.tower_steps[tower] - g.endstop_steps[tower])*g.step_size
 
     # Trilateration
     # Calculate intersection of 3 spheres, simplified version of code at https://stackoverflow.com/a/18654302
     def nozzle_position(self):
-        sphere_centers = [self.carriage_position(tower) for tower in [0,1,2]]
-        temp1 = sphere_centers[1]-sphere_centers[0]
-        d = norm(temp1)
-        e_x = temp1/d
-        temp2 = sphere_centers[2]-sphere_centers[0]
-        i = dot(e_x,temp2)
-        temp3 = temp2 - i*e_x
-        e_y = temp3/norm(temp3)
-        e_z = cross(e_x,e_y)
-        j = dot(e_y,temp2)
-        x = (self.l[0]**2 - self.l[1]**2 + d*d) / (2*d)
-        y = (self.l[0]**2 - self.l[2]**2 -2*i*x + i*i + j*j) / (2*j)
-        temp4 = self.l[0]**2 - x*x - y*y
-        if temp4<0:
-            raise Exception("The three spheres do not intersect!")
-        z = sqrt(temp4)
-        return sphere_centers[0] + x*e_x + y*e_y - z*e_z
-    
+        l2 = self.geometry.lengths2
+        return array(trilaterate_point(self.carriage_coords(0), self.carriage_coords(1), self.carriage_coords(2), l2[0], l2[1], l2[2]))
+
+    # Batch version of nozzle_position(), steps is (N,3) array of tower steps,
+    # returns (N,3) array of nozzle positions and (N,) mask of points where the spheres intersect,
+    # positions are NaN where they do not.
+    def nozzle_positions(self, steps, out = None):
+        return trilaterate(self.carriage_positions(steps), self.l, out)
+
+    # Batch version of carriage_position(), returns (N,3,3) array of carriage positions per tower
+    def carriage_positions(self, steps):
+        steps = asarray(steps, dtype=float)
+        n = steps.shape[0]
+        g = self.geometry
+        centers = zeros((n, 3, 3))
+        for tower in [0,1,2]:
+            centers[:,tower,0] = g.tower_xy[tower][0]
+            centers[:,tower,1] = g.tower_xy[tower][1]
+            centers[:,tower,2] = (steps[:,tower] - g.endstop_steps[tower])*g.step_size
+        return centers
+
     def tower_step_deltas(self):
         return [s-h for h, s in zip(self.tower_home_steps, self.tower_steps)]
 
@@ -96,12 +250,174 @@ class DeltaPrinter:
         parser.add_argument('-t','--t-value',type=str,default=None,help='Tower moves, semicolon separated, in mm')
         return parser
 
+# Trilateration of a single point, c0..c2 are sphere centers as (x, y, z) and l0..l2 squared radii.
+# Plain float math, for 3-vectors it is much cheaper than numpy calls.
+def trilaterate_point(c0, c1, c2, l0, l1, l2):
+    ax, ay, az = c1[0]-c0[0], c1[1]-c0[1], c1[2]-c0[2]
+    d = math.sqrt(ax*ax + ay*ay + az*az)
+    ex, ey, ez = ax/d, ay/d, az/d
+    bx, by, bz = c2[0]-c0[0], c2[1]-c0[1], c2[2]-c0[2]
+    i = ex*bx + ey*by + ez*bz
+    tx, ty, tz = bx - i*ex, by - i*ey, bz - i*ez
+    n = math.sqrt(tx*tx + ty*ty + tz*tz)
+    fx, fy, fz = tx/n, ty/n, tz/n
+    gx, gy, gz = ey*fz - ez*fy, ez*fx - ex*fz, ex*fy - ey*fx
+    j = fx*bx + fy*by + fz*bz
+    x = (l0 - l1 + d*d) / (2*d)
+    y = (l0 - l2 -2*i*x + i*i + j*j) / (2*j)
+    temp4 = l0 - x*x - y*y
+    if temp4<0:
+        raise Exception("The three spheres do not intersect!")
+    z = math.sqrt(temp4)
+    return (c0[0] + x*ex + y*fx - z*gx, c0[1] + x*ey + y*fy - z*gy, c0[2] + x*ez + y*fz - z*gz)
+
+# Batch trilateration, centers is (...,3,3) array of sphere centers (carriage positions per tower, e.g. (N,3,3)),
+# lengths are 3 rod lengths or (...,3) array of them broadcasting to the leading dimensions of centers,
+# results go to `out` (...,3) if given
+def trilaterate(centers, lengths, out = None):
+    return trilaterate_components(centers[...,0], centers[...,1], centers[...,2], asarray(lengths, dtype=float)**2, out)
+
+# Same math as trilaterate_point() on component arrays: cx, cy, cz are (...,3) sphere center coordinates per tower
+# and l2 (...,3) squared radii, all broadcasting together, so values shared by many points (tower xy, lengths)
+# are not repeated. Returns (...,3) positions, NaN where the spheres do not intersect, and (...) mask where they do.
+def trilaterate_components(cx, cy, cz, l2, out = None):
+    ax, ay, az = cx[...,1]-cx[...,0], cy[...,1]-cy[...,0], cz[...,1]-cz[...,0]
+    d = sqrt(ax*ax + ay*ay + az*az)
+    ex, ey, ez = ax/d, ay/d, az/d
+    bx, by, bz = cx[...,2]-cx[...,0], cy[...,2]-cy[...,0], cz[...,2]-cz[...,0]
+    i = ex*bx + ey*by + ez*bz
+    fx, fy, fz = bx - i*ex, by - i*ey, bz - i*ez
+    n = sqrt(fx*fx + fy*fy + fz*fz)
+    fx, fy, fz = fx/n, fy/n, fz/n
+    j = fx*bx + fy*by + fz*bz
+    x = (l2[...,0] - l2[...,1] + d*d) / (2*d)
+    y = (l2[...,0] - l2[...,2] -2*i*x + i*i + j*j) / (2*j)
+    temp4 = l2[...,0] - x*x - y*y
+    with errstate(invalid='ignore'):
+        intersect = temp4 >= 0
+        z = sqrt(where(intersect, temp4, nan))
+    if out is None:
+        out = empty(intersect.shape + (3,))
+    # e_z = e_x x e_y, written out to skip cross()
+    out[...,0] = cx[...,0] + x*ex + y*fx - z*(ey*fz - ez*fy)
+    out[...,1] = cy[...,0] + x*ey + y*fy - z*(ez*fx - ex*fz)
+    out[...,2] = cz[...,0] + x*ez + y*fz - z*(ex*fy - ey*fx)
+    return out, intersect
+
 def error(physical, logical, x, y, z = 0):
     # we move logical model of the printer, copy carriage positions to physical model and see where the nozzle tip ends up
     logical.move(x, y, z)
     physical.tower_steps = logical.tower_steps
     return physical.nozzle_position()
 
+# Batch version of error(), returns (N,3) nozzle positions and (N,) mask of valid points
+def errors(physical, logical, points):
+    return physical.nozzle_positions(logical.move_many(points))
+
+# Geometry-batched errors(): G candidate physical printers, all driven by the same logical printer to M points.
+# Candidate lengths, radii, angles (in deg) and endstops are (G,3) arrays or anything broadcasting to them,
+# e.g. (G,1) columns for the same value on every tower. Candidates are DeltaPrinter(lengths, radii, step_size,
+# angles, endstops) with vertical towers (DeltaPrinterLean candidates are not supported), the logical printer
+# may be any, positions are the same as errors() of every candidate.
+# Yields (start, positions, valid) for consecutive chunks of candidates, positions are (g,M,3) with NaN where
+# the spheres do not intersect and valid is (g,M), chunks are sized to about `chunk` points to bound temporaries.
+def errors_chunks(logical, points, lengths, radii, angles = (210., 330., 90.), endstops = 0., step_size = None, chunk = 1 << 16):
+    steps = logical.move_many(points)
+    step_size = step_size or logical.step_size
+    lengths, radii, angles, endstops = [asarray(v, dtype=float) for v in (lengths, radii, angles, endstops)]
+    count = max(v.shape[0] if v.ndim > 1 else 1 for v in (lengths, radii, angles, endstops))
+    size = max(1, chunk // len(steps))
+
+    def rows(v, start):
+        v = v if v.ndim > 1 else v.reshape(1, -1)
+        return (v[start:start+size] if v.shape[0] > 1 else v) + zeros((1, 3))
+
+    for start in range(0, count, size):
+        l, r, a, e = broadcast_arrays(*[rows(v, start) for v in (lengths, radii, angles, endstops)])
+        a = radians(a)
+        # carriage positions as in carriage_positions(), tower xy only depends on the candidate
+        tz = (steps[None,:,:] - (e/step_size)[:,None,:])*step_size
+        positions, valid = trilaterate_components((r*cos(a))[:,None,:], (r*sin(a))[:,None,:], tz, (l*l)[:,None,:])
+        yield start, positions, valid
+
+# errors_chunks() gathered into (G,M,3) positions and (G,M) mask
+def errors_many(logical, points, lengths, radii, angles = (210., 330., 90.), endstops = 0., step_size = None, chunk = 1 << 16):
+    parts = list(errors_chunks(logical, points, lengths, radii, angles, endstops, step_size, chunk))
+    return concatenate([p for s, p, v in parts]), concatenate([v for s, p, v in parts])
+
+# Column order of jacobian()
+jacobian_params = ['l0', 'l1', 'l2', 'r0', 'r1', 'r2', 'a0', 'a1', 'a2', 'e0', 'e1', 'e2']
+
+# (12, P) matrix turning jacobian() columns into columns of params, a parameter without tower index
+# (l, r, a, e) is the same deviation on every tower
+def jacobian_columns(params):
+    m = zeros((len(jacobian_params), len(params)))
+    for i, p in enumerate(params):
+        for name in [p] if p in jacobian_params else [p + str(t) for t in range(3)]:
+            m[jacobian_params.index(name), i] = 1.
+    return m
+
+# Analytic derivatives of error() nozzle positions, for a batch of points, with respect to
+# rod lengths, radii, tower angles (per degree) and endstops of the physical printer (wrt='physical')
+# or of the logical one (wrt='logical'). Endstops shift carriages (see carriage_coords()): a physical
+# endstop lowers its carriage, a logical one raises it by adding steps.
+# Returns (N,3,12) array, columns in jacobian_params order, and (N,) mask of valid points.
+# Printers with leaning towers (DeltaPrinterLean) raise TypeError, except a logical one with wrt='physical'.
+# Trilateration is differentiated implicitly: each nozzle position p satisfies |p - c_i|^2 = L_i^2,
+# so (p - c_i).dp = (p - c_i).dc_i + L_i*dL_i for every tower i.
+# Logical derivatives go through inverse kinematics without step rounding.
+def jacobian(physical, logical, points, wrt = 'physical'):
+    # carriages are differentiated as moving vertically
+    for printer in [physical, logical] if wrt == 'logical' else [physical]:
+        if not getattr(printer, 'vertical', True):
+            raise TypeError("jacobian() does not support leaning towers")
+    steps = logical.move_many(points)
+    nps, intersect = physical.nozzle_positions(steps)
+    n = nps.shape[0]
+    pg = physical.geometry
+    tower_xy = array(pg.tower_xy)
+    centers = zeros((n, 3, 3))
+    centers[:,:,0:2] = tower_xy
+    centers[:,:,2] = (steps - array(pg.endstop_steps))*pg.step_size
+    arms = nps[:,None,:] - centers  # (N,3 towers,3)
+
+    # right hand side, per tower row and parameter column
+    b = zeros((n, 3, 12))
+    towers = [0, 1, 2]
+    if wrt == 'physical':
+        g = pg
+        theta = radians(array(g.angles))
+        b[:,towers,towers] = array(g.lengths)
+        b[:,towers,[3,4,5]] = arms[:,:,0]*cos(theta) + arms[:,:,1]*sin(theta)
+        b[:,towers,[6,7,8]] = (-arms[:,:,0]*sin(theta) + arms[:,:,1]*cos(theta)) * array(g.radii) * pi/180
+        b[:,towers,[9,10,11]] = -arms[:,:,2]
+    elif wrt == 'logical':
+        g = logical.geometry
+        theta = radians(array(g.angles))
+        points = asarray(points, dtype=float)
+        tx, ty = array(g.tower_xy).T
+        dx = tx - points[:,0,None]
+        dy = ty - points[:,1,None]
+        with errstate(invalid='ignore'):
+            s = sqrt(array(g.lengths2) - dx**2 - dy**2)
+        # carriage height derivatives, scaled by how much each carriage moves the nozzle
+        dz = zeros((n, 3, 4))
+        dz[:,:,0] = array(g.lengths)/s
+        dz[:,:,1] = -(dx*cos(theta) + dy*sin(theta))/s
+        dz[:,:,2] = -(-dx*sin(theta) + dy*cos(theta)) * array(g.radii) * pi/180 / s
+        dz[:,:,3] = 1.
+        for k in range(4):
+            b[:,towers,[3*k, 3*k+1, 3*k+2]] = arms[:,:,2]*dz[:,:,k]
+    else:
+        raise Exception("wrt must be 'physical' or 'logical'")
+
+    valid = intersect & ~(b != b).any(axis=(1,2))
+    arms[~valid] = eye(3)
+    b[~valid] = 0
+    result = solve(arms, b)
+    result[~valid] = nan
+    return result, valid
+
 # Example usage:
 #   ./delta_printer.py -l 120 -r 62 -s 0.01 -n '0,10,0;0,-10,5'
 if __name__ == '__main__':
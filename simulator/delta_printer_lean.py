@@ -1,70 +1,94 @@
 #!/usr/bin/env python3
 
 import sys
+import math
 import argparse
 
-from numpy import sqrt, dot, cross, array, zeros, radians, cos, sin, tan, pi
-from numpy.linalg import norm
+from numpy import sqrt, array, asarray, rint, errstate
 
-from delta_printer import DeltaPrinter
+from delta_printer import DeltaPrinter, parse_values
 
-# FIXME tower lean does not work correctly
-# TODO Support different L/R per tower
-# TODO Support different lean and step_size per tower
+# TODO Support different step_size per tower
 
+# Towers lean by angle t from the bed plane, t<90 means the tower top leans outwards.
+# Carriage moves along the tower rail: at rail position s it is s*cos(t) further from the
+# center than the tower base and s*sin(t) above the bed, tower steps count rail position.
 class DeltaPrinterLean(DeltaPrinter):
+
+    @classmethod
+    def from_args(cls, args):
+        printer = DeltaPrinter.from_args(args)
+        return cls(printer.l, printer.r, printer.step_size, printer.tower_angles, printer.endstops, parse_values(args.tl_value))
+
     def __init__(self, length, radius, step_size = 0.01, angles = [210., 330., 90.], endstops = [0., 0., 0.], lean = 90.0):
         super().__init__(length, radius, step_size, angles, endstops)
-        self.tower_lean = lean # tower lean, t<90 means towers lean outwards
+        self.tower_lean = [float(t) for t in lean] if type(lean) is list else [float(lean)]*3
+        self.vertical = all(t == 90.0 for t in self.tower_lean)
+
+        # pre-calc, rail direction per tower
+        self.tower_rails = []
+        for idx, angle in enumerate(self.tower_angles):
+            t = math.radians(self.tower_lean[idx])
+            a = math.radians(angle)
+            self.tower_rails.append((math.cos(t)*math.cos(a), math.cos(t)*math.sin(a), math.sin(t)))
 
+    def fingerprint(self):
+        return (self.geometry, tuple(self.tower_lean))
+
+    # Carriage at rail position s is on the arm sphere around the nozzle p:
+    #   |b + s*u - p|^2 = L^2, b - tower base, u - rail direction
+    #   s^2 + 2*s*u.(b-p) + |b-p|^2 - L^2 = 0, the upper root is the carriage
     def move(self, x, y, z = 0, force = False):
+        if self.vertical:
+            return super().move(x, y, z, force)
         if self.tower_steps[0] is None and not force:
             raise Exception("Must home first")
-        if self.tower_lean == 90.0:
-            super().move(x, y, z, force)
+        g = self.geometry
         for tower in [0, 1, 2]:
-            print("ERROR! FIXME")
-            tx = self.tower_coords[tower][0]
-            ty = self.tower_coords[tower][1]
-            tr = sqrt((tx-x)*(tx-x) + (ty-y)*(ty-y)) # distance from tower base to (x,y)
+            ux, uy, uz = self.tower_rails[tower]
+            bx = g.tower_xy[tower][0] - x
+            by = g.tower_xy[tower][1] - y
+            bz = -z
+            ub = ux*bx + uy*by + uz*bz
+            s = -ub + math.sqrt(ub*ub - (bx*bx + by*by + bz*bz) + g.lengths2[tower])
+            self.tower_steps[tower] = round(s/g.step_size) + g.endstop_steps[tower]
 
-            # r_error_z                     <-- tower projection for z
-            # tga                           <-- tan of tower lean
-            # r_z = tr + r_error_z          <-- distance from (x,y) to carriage projection for z
-            # c_z = tga * r_error_z         <-- carriage height for z
+    def move_many(self, points, force = False):
+        if self.vertical:
+            return super().move_many(points, force)
+        if self.tower_steps[0] is None and not force:
+            raise Exception("Must home first")
+        points = asarray(points, dtype=float)
+        g = self.geometry
+        u = array(self.tower_rails)
+        bx = array(g.tower_xy)[:,0] - points[:,0,None]
+        by = array(g.tower_xy)[:,1] - points[:,1,None]
+        bz = -points[:,2,None] if points.shape[1] > 2 else 0.
+        ub = u[:,0]*bx + u[:,1]*by + u[:,2]*bz
+        with errstate(invalid='ignore'):
+            s = -ub + sqrt(ub*ub - (bx*bx + by*by + bz*bz) + array(g.lengths2))
+        return rint(s/g.step_size) + array(g.endstop_steps)
 
-            # (X-X0)^2 + (Y-Y0)^2 = R^2     <-- generic circle equation
-            # (r_z-0)^2 + (c_z-z)^2 = L^2   <-- circle with center in (x,y,z) in plane of tower arm
-            # (c_z/tga + tr)^2 + c_z^2 - 2*z*c_z + z^2 - L^2 = 0
-            # (1+1/tga^2)*c_z^2 + (2*tr/tga - 2*z)*c_z + tr^2 + z^2 - L^2 = 0
-            
-            # solve for c_z and convert to actual carriage position on rail
+    def carriage_coords(self, tower):
+        if self.vertical:
+            return super().carriage_coords(tower)
+        g = self.geometry
+        s = (self.tower_steps[tower] - g.endstop_steps[tower]) * g.step_size
+        ux, uy, uz = self.tower_rails[tower]
+        return self.tower_coords[tower][0] + s*ux, self.tower_coords[tower][1] + s*uy, s*uz
 
-            tga = tan(radians(self.tower_lean))
-            a = 1 + 1/(tga*tga)
-            b_2 = tr/tga - z
-            c = tr*tr + z*z - self.l*self.l
-            d_2 = b_2*b_2 - a*c
-            if d_2 < 0:
-                raise Exception('spam', 'eggs')
-            c_z = (sqrt(d_2) - b_2)/a 
-            c_position = c_z / sin(radians(self.tower_lean))
-            self.tower_steps[tower] = round(c_position/self.step_size)
+    def carriage_positions(self, steps):
+        if self.vertical:
+            return super().carriage_positions(steps)
+        g = self.geometry
+        s = (asarray(steps, dtype=float) - array(g.endstop_steps))[:,:,None] * g.step_size
+        return self.tower_base()[None] + s*array(self.tower_rails)[None]
 
-    def carriage_position(self, tower):
-        if self.tower_lean == 90.0:
-            return super().carriage_position(tower)
-        else:
-            print("ERROR! FIXME")
-            _re = self.tower_steps[tower] * self.step_size * cos(radians(self.tower_lean))
-            _r = self.r + _re
-            _x = cos(radians(self.tower_angles[tower])) * _r
-            _y = sin(radians(self.tower_angles[tower])) * _r
-            _z = self.tower_steps[tower] * self.step_size * sin(radians(self.tower_lean))
-            return array([_x, _y, _z])
+    def tower_base(self):
+        return array([[x, y, 0.] for x, y in self.tower_coords])
 
     @staticmethod
     def argument_parser():
         parser = DeltaPrinter.argument_parser()
-        parser.add_argument('-tl','--tl-value',type=float,default=90.0,help='Tower lean, in deg, tl<90 means towers lean outwards')
+        parser.add_argument('-tl','--tl-value',type=str,default="90",help='Tower lean(s), in deg, tl<90 means towers lean outwards')
         return parser
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from delta_printer import errors
+from common import add_geometry_arguments, printers_from_args
+
+# Precomputed nozzle error field for a fixed pair of geometries.
+# Lattice of (dx, dy, dz) = nozzle position - commanded position, shape (nz, ny, nx, 3), is saved as
+# plain .npy (memory-mappable) with bounds and interpolation error estimates in a .json sidecar.
+# Queries interpolate the lattice (order 1 - trilinear, 3 - tricubic spline) instead of running kinematics.
+#
+# Examples:
+#   ./error_table.py build warp.npy -l 123.5 -r 63.7 -wl 120 -wr 62.7 -g 0.5
+#   ./error_table.py build warp.npy -l 123.5 -r 63.7 -wl 120 -wr 62.7 -z 0,60,5
+#   ./error_table.py query warp.npy -p '0,0;10,20;-30,5,2'
+#   ./replay.py part.gcode -t warp.npy
+
+class ErrorTable:
+
+    def __init__(self, lattice, origin, spacing, meta = None):
+        self.lattice = lattice
+        self.origin = np.array(origin, dtype=float)     # x, y, z of lattice[0,0,0]
+        self.spacing = np.array(spacing, dtype=float)   # x, y, z lattice steps
+        self.meta = meta or {}
+        self.coefficients = {}
+
+    @classmethod
+    def build(cls, correct, wrong, radius = 50., grid = 1., z_values = (0.,)):
+        xs = np.arange(-radius, radius + grid/2, grid)
+        z_values = np.array(z_values, dtype=float)
+        nz, n = len(z_values), len(xs)
+        X, Y = np.meshgrid(xs, xs)
+        lattice = np.empty((nz, n, n, 3))
+        for k, z in enumerate(z_values):
+            points = np.column_stack((X.ravel(), Y.ravel(), np.full(X.size, z)))
+            lattice[k] = (errors(correct, wrong, points)[0] - points).reshape(n, n, 3)
+        z_step = z_values[1] - z_values[0] if nz > 1 else 1.
+        table = cls(lattice, (xs[0], xs[0], z_values[0]), (grid, grid, z_step))
+
+        # interpolation error, measured at cell centers (worst place for interpolation), on the first layer
+        centers = xs[:-1] + grid/2
+        X, Y = np.meshgrid(centers, centers)
+        points = np.column_stack((X.ravel(), Y.ravel(), np.full(X.size, z_values[0])))
+        exact = errors(correct, wrong, points)[0] - points
+        bounds = {}
+        for order in [1, 3]:
+            diff = np.abs(table.lookup(points, order) - exact)
+            bounds[str(order)] = np.nanmax(diff, axis=0).tolist()
+        table.meta = {'error_bound': bounds}
+        return table
+
+    def save(self, file_name):
+        np.save(file_name, self.lattice)
+        meta = dict(self.meta, origin=self.origin.tolist(), spacing=self.spacing.tolist())
+        with open(file_name + ".json", 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, file_name, mmap = True):
+        lattice = np.load(file_name, mmap_mode='r' if mmap else None)
+        with open(file_name + ".json") as f:
+            meta = json.load(f)
+        return cls(lattice, meta['origin'], meta['spacing'], meta)
+
+    # Returns lattice coordinates (z, y, x order) of (N,2) or (N,3) points
+    def coordinates(self, points):
+        points = np.asarray(points, dtype=float)
+        z = points[:,2] if points.shape[1] > 2 else np.full(len(points), self.origin[2])
+        coords = [
+            (z - self.origin[2]) / self.spacing[2],
+            (points[:,1] - self.origin[1]) / self.spacing[1],
+            (points[:,0] - self.origin[0]) / self.spacing[0],
+        ]
+        if self.lattice.shape[0] == 1:
+            coords[0] = np.zeros(len(points))
+        return coords
+
+    # Returns (N,) mask of points beyond table bounds, lookup() is NaN there whether reachable or not
+    def outside(self, points):
+        result = np.zeros(len(points), dtype=bool)
+        for c, size in zip(self.coordinates(points), self.lattice.shape[0:3]):
+            result |= (c < 0) | (c > size - 1)
+        return result
+
+    # points is (N,2) or (N,3) array, returns (N,3) errors, NaN outside of the table or printable area
+    def lookup(self, points, order = 1):
+        from scipy.ndimage import map_coordinates, spline_filter, binary_dilation
+
+        coords = self.coordinates(points)
+        result = np.empty((len(points), 3))
+        for axis in range(3):
+            if order > 1:
+                # spline coefficients are computed once per axis, NaN (unreachable) cells are filled with zero error
+                # and every point depending on them is masked below
+                if (order, axis) not in self.coefficients:
+                    self.coefficients[(order, axis)] = spline_filter(np.nan_to_num(self.lattice[...,axis]), order=order, mode='nearest')
+                values = self.coefficients[(order, axis)]
+            else:
+                values = self.lattice[...,axis]
+            result[:,axis] = map_coordinates(values, coords, order=order, mode='constant', cval=np.nan, prefilter=False)
+        if order > 1:
+            if 'invalid' not in self.coefficients:
+                self.coefficients['invalid'] = binary_dilation(np.isnan(self.lattice[...,0]), iterations=order//2+1).astype(float)
+            outside = map_coordinates(self.coefficients['invalid'], coords, order=1, mode='nearest') > 0
+        else:
+            outside = np.zeros(len(points), dtype=bool)
+        result[outside | self.outside(points)] = np.nan
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Nozzle error lookup table')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Compute and save table')
+    build.add_argument('table',type=str,help='Table .npy file')
+    add_geometry_arguments(build)
+    build.add_argument('-R','--radius',type=float,default=50.,help='Table covers [-radius, radius] in X and Y, in mm')
+    build.add_argument('-g','--grid',type=float,default=1.,help='Lattice spacing, in mm')
+    build.add_argument('-z','--z-range',type=str,default=None,help='Z layers as start,end,step, in mm, only Z=0 by default')
+
+    query = commands.add_parser('query', help='Interpolate errors at points')
+    query.add_argument('table',type=str,help='Table .npy file')
+    query.add_argument('-p','--points',type=str,required=True,help='Semicolon separated x,y or x,y,z points, in mm')
+    query.add_argument('-o','--order',type=int,default=1,choices=[1, 3],help='Interpolation order')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        correct, wrong = printers_from_args(args)
+        z_values = [0.]
+        if args.z_range:
+            start, end, step = [float(v) for v in args.z_range.split(',')]
+            z_values = np.arange(start, end + step/2, step)
+        table = ErrorTable.build(correct, wrong, args.radius, args.grid, z_values)
+        table.save(args.table)
+        print("Table {0} saved to {1}".format(table.lattice.shape, args.table))
+        for order, bound in table.meta['error_bound'].items():
+            print("Interpolation error bound, order {0}: {1:.4f}, {2:.4f}, {3:.4f}".format(order, *bound))
+    else:
+        table = ErrorTable.load(args.table)
+        points = np.array([[float(v) for v in p.split(',')] for p in args.points.split(';')] if ';' in args.points else [[float(v) for v in args.points.split(',')]])
+        if points.shape[1] == 2:
+            points = np.column_stack((points, np.zeros(len(points))))
+        for point, err in zip(points, table.lookup(points, args.order)):
+            print("{0:.3f},{1:.3f},{2:.3f}: {3:.4f}, {4:.4f}, {5:.4f}".format(*point, *err))
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,17 @@
 
 import sys
 import argparse
+import functools
 
-from delta_printer import DeltaPrinter, error
+import numpy as np
 
-def try_for(l, r, observations, error_treshold = 0.5):
+from delta_printer import DeltaPrinter, error, errors, errors_many, move_cache
+from sweep import sweep, adaptive, f_range
+from store import SweepStore, sweep_key
+from instrument import profile, tally
+
+# rejections by flatness are printed unless verbose is False
+def try_for(l, r, observations, error_treshold = 0.5, verbose = True):
     # finds all L/R pairs that give correct dimensions, consumes observations
     max_error = 0
     for o in observations:
@@ -15,11 +22,14 @@ def try_for(l, r, observations, error_treshold = 0.5):
         observed_r = float(o[1])
         trial = DeltaPrinter(trial_l, trial_r)
         observed  = DeltaPrinter(observed_l, observed_r)
+        observed.cache = move_cache
+        observed.home()
 
         max_y = error(trial, observed, 0, 50)[1]
         min_y = error(trial, observed, 0, -50)[1]
         xy_error = (max_y - min_y) - float(o[2])
         if abs(xy_error) > error_treshold:
+            tally('rejected')
             return 100
         if abs(xy_error) > abs(max_error):
             max_error = xy_error
@@ -29,24 +39,84 @@ def try_for(l, r, observations, error_treshold = 0.5):
         for point in points:
             ep = error(trial, observed, point[0], point[1])[2] - center_error
             if abs(ep - point[2]) > 0.07: #error_treshold:
-                print("{0:.3f}, {1:.3f}, {2:.3f}, {3:.3f}, {4:.3f}".format(l, r, point[0], point[1], ep - point[2]))
+                if verbose:
+                    print("{0:.3f}, {1:.3f}, {2:.3f}, {3:.3f}, {4:.3f}".format(l, r, point[0], point[1], ep - point[2]))
                 # exit(1)
+                tally('rejected')
                 return 100
     return max_error
 
-def f_range(start, end, step):
-    while start <= end:
-        yield start
-        start += step
+# Continuous counterpart of try_for() for adaptive search, <= 1 exactly when try_for() accepts L/R pair
+def cost_for(l, r, observations, error_treshold = 0.5):
+    cost = 0
+    for o in observations:
+        trial = DeltaPrinter(l, r)
+        observed  = DeltaPrinter(float(o[0]), float(o[1]))
+        observed.home()
+
+        # [0,50], [0,-50], [0,0], then points
+        nps, valid = errors(trial, observed, cost_points[:,0:2])
+        # unreachable points, nothing is known about the cell (max() would drop NaN)
+        if not valid.all():
+            return np.nan
+        xy_error = (nps[0][1] - nps[1][1]) - float(o[2])
+        cost = max(cost, abs(xy_error) / error_treshold)
+        cost = max(cost, abs(nps[3:,2] - nps[2][2] - cost_points[3:,2]).max() / 0.07)
+    return cost
+
+# Batch version of try_for() for cells (ls[k], rs[k]), all candidate printers are evaluated in one array pass
+# per observation. Cells with unreachable points are rejected (try_for() raises on them).
+def try_for_many(ls, rs, observations, error_treshold = 0.5, verbose = True):
+    ls = np.asarray(ls, dtype=float)
+    rs = np.asarray(rs, dtype=float)
+    max_error = np.zeros(len(ls))
+    rejected = np.zeros(len(ls), dtype=bool)
+    messages = {}
+    for o in observations:
+        observed  = DeltaPrinter(float(o[0]), float(o[1]))
+        observed.home()
+
+        # [0,50], [0,-50], [0,0], then points
+        nps, valid = errors_many(observed, cost_points[:,0:2], ls[:,None], rs[:,None])
+        xy_error = (nps[:,0,1] - nps[:,1,1]) - float(o[2])
+        failed = ~rejected & (~valid.all(axis=1) | (abs(xy_error) > error_treshold))
+        rejected |= failed
+        max_error = np.where(abs(xy_error) > abs(max_error), xy_error, max_error)
+
+        ep = nps[:,3:,2] - nps[:,2,None,2] - cost_points[3:,2]
+        flat = ~rejected & (abs(ep) > 0.07).any(axis=1)
+        for k in np.flatnonzero(flat) if verbose else []:
+            p = np.argmax(abs(ep[k]) > 0.07)
+            messages[k] = "{0:.3f}, {1:.3f}, {2:.3f}, {3:.3f}, {4:.3f}".format(ls[k], rs[k], cost_points[3+p,0], cost_points[3+p,1], ep[k,p])
+        rejected |= flat
+    # same output as try_for() calls in cell order would give
+    for k in sorted(messages):
+        print(messages[k])
+    tally('rejected', int(rejected.sum()))
+    return np.where(rejected, 100, max_error).tolist()
+
+cost_points = np.array([[0,50,0],[0,-50,0],[0,0,0],[0,0,0],[0,-50,0.3],[0,50,0]])
 
 # Example: ./find_lr.py -l 120.8 -r 61.7 -o '122.49,63.16,99;121.36,62.7,99.5' -f 1
 
+# searched L/R grid, cells with abs(try_for()) below match_limit are printed
+l_range = (110.0, 150.0)
+r_range = (55.0, 90.0)
+match_limit = 100
+
 def main():
 
     s_value = 0.05
 
     parser = argparse.ArgumentParser(description='Delta errors simulation')
     parser.add_argument('-s','--s-value',type=float,default=s_value,help='Step value')
+    parser.add_argument('-ad','--adaptive',action='store_true',help='Coarse-to-fine search instead of full grid')
+    parser.add_argument('-c','--coarse',type=int,default=16,help='Initial stride of adaptive search, in steps')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='Number of worker processes, defaults to number of cores')
+    parser.add_argument('-sc','--scalar',action='store_true',help='Evaluate cells one by one with try_for() instead of geometry-batched try_for_many()')
+    parser.add_argument('-pf','--profile',type=str,nargs='?',const='summary',default=None,help='Print call counts and timings, or save cProfile stats to given file; runs single process')
+    parser.add_argument('-db','--store',type=str,default=None,help='Keep evaluated cells in sweep store file, resumes and reuses earlier runs')
+    parser.add_argument('-b','--best',type=int,default=None,help='Print best N stored cells instead of sweeping, needs -db')
     parser.add_argument('-o','--observations',type=str,dest='observations',default=None,help='Semicolon separated observation triplets, each in form or: l,r,dimension observed')
     args = parser.parse_args()
 
@@ -54,13 +124,34 @@ def main():
         print("Observations shall be provided")
         exit(1)
 
+    if args.profile:
+        args.jobs = 1
     observations = [x.split(",") for x in args.observations.split(";")]
-    for l in f_range(110.0, 150.0, args.s_value):
-        print(l)
-        for r in f_range(55.0, 90.0, args.s_value):
-            e = try_for(l, r, observations, 0.2)
-            if abs(e) < 100:
+    store = SweepStore(args.store, sweep_key(tool='find_correct', observations=observations, threshold=0.2)) if args.store else None
+    if args.best and store is None:
+        parser.error("-b needs -db")
+    if args.best:
+        for (l, r), e in store.best(args.best):
+            print("L{0}, R{1} - {2:.2f}".format(l, r, e))
+        return
+    evaluate = functools.partial(try_for, observations=observations, error_treshold=0.2)
+    batch = None if args.scalar else functools.partial(try_for_many, observations=observations, error_treshold=0.2)
+    def run():
+        if args.adaptive:
+            cost = functools.partial(cost_for, observations=observations, error_treshold=0.2)
+            matches, stats = adaptive(evaluate, cost, f_range(*l_range, args.s_value), f_range(*r_range, args.s_value), match_limit, args.coarse, jobs=args.jobs, store=store, batch=batch)
+            for l, r, e in matches:
                 print("L{0}, R{1} - {2:.2f}".format(l, r, e))
+            print("Evaluated {0} cost and {1} try_for of {2} grid cells".format(stats['cost'], stats['evaluate'], stats['grid']), file=sys.stderr)
+            return
+        for l, matches in sweep(evaluate, f_range(*l_range, args.s_value), f_range(*r_range, args.s_value), match_limit, args.jobs, store, batch):
+            print(l)
+            for l, r, e in matches:
+                print("L{0}, R{1} - {2:.2f}".format(l, r, e), flush=True)
+    try:
+        profile(args.profile, run)
+    except KeyboardInterrupt:
+        exit(130)
 
 if __name__ == '__main__':
     main()
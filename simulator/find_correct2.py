@@ -3,19 +3,14 @@
 import sys
 import argparse
 import math
+import itertools
 
-from delta_printer import DeltaPrinter, error
+import numpy as np
 
-def get_points_wheel(max_dist = 50, scatter_step = 5, angle_step = 15.):
-    points = [(0, 0)]
-    scatter = [x/100 for x in range(100, 5, -scatter_step)]
-    for i in range(len(scatter)):
-        dist = max_dist * scatter[i]
-        for j in range(int(360/angle_step)):
-            r = math.radians(90. + angle_step * j)
-            #points.append((int(math.cos(r) * dist), int(math.sin(r) * dist)))
-            points.append((math.cos(r) * dist, math.sin(r) * dist))
-    return points
+from delta_printer import DeltaPrinter, error, errors_many, move_cache, parse_values
+from common import get_points_wheel
+from store import SweepStore, sweep_key
+from instrument import profile, tally
 
 def points_to_nozzle_positions(points, wrong, correct):
     nozzle_positions = []
@@ -51,32 +46,31 @@ def get_round_distances(nozzle_positions, adjustment = 2):
         distances.append(dist)
     return distances
 
-def main():
-
-    # search space parameters
-    step = 0.1
-    area = 10
-
-    distances = 45 # expected distances between the centers
-    adjustment = 3.8 # pin/bolt head diameter
-    da = distances + adjustment
-
-    parser = argparse.ArgumentParser(description='Delta errors simulation')
-    parser.add_argument('-l','--l-value',type=str,default="120.8",help='Diagonal rod lengths')
-    parser.add_argument('-r','--r-value',type=str,default="61.7",help='Delta radii')
-    parser.add_argument('-a','--a-value',type=str,default="210,330,90",help='Tower angles, in deg')
-    parser.add_argument('-cd','--cd-value',type=str,default="{0},{0},{0},{0},{0},{0}".format(da),help='Center distances')
-    parser.add_argument('-rd','--rd-value',type=str,default="{0},{0},{0},{0},{0},{0}".format(da),help='Round distances')
-    args = parser.parse_args()
+def distances_error(nps, observe_c, observe_r, adjustment):
+    cds = get_center_distances(nps, adjustment)
+    rds = get_round_distances(nps, adjustment)
+    cur_error = 0.0
+    for i in range(6):
+        # cur_error += abs(observe_c[i]-cds[i])
+        cur_error += (observe_c[i]-cds[i])*(observe_c[i]-cds[i])
+        cur_error += (observe_r[i]-rds[i])*(observe_r[i]-rds[i])
+    return cur_error
 
-    l = [float(l) for l in args.l_value.split(',')] if "," in args.l_value else [float(args.l_value) for x in range(3)]
-    r = [float(r) for r in args.r_value.split(',')] if "," in args.r_value else [float(args.r_value) for x in range(3)]
-    a = [float(a) for a in args.a_value.split(',')]
+# Batch version of distances_error() for (G,M,3) nozzle positions, returns (G,) errors
+def distances_errors(nps, observe_c, observe_r, adjustment):
+    cds = np.hypot(nps[:,1:,0]-nps[:,0,None,0], nps[:,1:,1]-nps[:,0,None,1]) + adjustment
+    shifted = np.roll(nps[:,1:], -1, axis=1)
+    rds = np.hypot(nps[:,1:,0]-shifted[...,0], nps[:,1:,1]-shifted[...,1]) + adjustment
+    cur_error = np.zeros(len(nps))
+    for i in range(6):
+        cur_error += (observe_c[i]-cds[:,i])*(observe_c[i]-cds[:,i])
+        cur_error += (observe_r[i]-rds[:,i])*(observe_r[i]-rds[:,i])
+    return cur_error
 
-    observe_c = [float(cd) for cd in args.cd_value.split(',')]
-    observe_r = [float(rd) for rd in args.cd_value.split(',')]
-
-    points = get_points_wheel(distances, distances*10, 60.)
+# Reference mode, tries every combination of rod lengths and tower A/B angles on the grid.
+# With a store (see store.py) errors are kept per rod lengths, a restarted search skips them.
+# Unless scalar is set, all angle combinations of rod lengths are evaluated at once with errors_many().
+def exhaustive(points, l, r, a, observe_c, observe_r, adjustment, step, area, store = None, scalar = False):
 
     lengths_orig = [l1-area/2*step for l1 in l]
     angles_orig = [a1-area/2*step for a1 in a]
@@ -90,6 +84,13 @@ def main():
     solution_r = r_orig
     min_error = 9999999999
 
+    # plain floats, cheaper than numpy scalars in the move() loop
+    points = np.asarray(points).tolist()
+
+    logical  = DeltaPrinter(l, r, 0.01, a)
+    logical.cache = move_cache
+    logical.home()
+
     c = (area+1)*(area+1)*(area+1)
     for ila in range(area+1):
         for ilb in range(area+1):
@@ -98,6 +99,21 @@ def main():
                 print(c)
                 # print(lengths)
                 c-=1
+                angle_cells = [(angles_orig[0]+step*iaa, angles_orig[1]+step*iab) for iaa in range(area+1) for iab in range(area+1)]
+                known = store.lookup([tuple(lengths) + cell for cell in angle_cells]) if store is not None else {}
+                if not scalar:
+                    todo = [cell for cell in angle_cells if tuple(lengths) + cell not in known]
+                    if todo:
+                        angles = np.array([[a0, a1, 90.0] for a0, a1 in todo])
+                        nps, valid = errors_many(logical, points, [lengths], [[r1+step*ir for r1 in r_orig]], angles)
+                        values = np.where(valid.all(axis=1), distances_errors(nps, observe_c, observe_r, adjustment), math.nan)
+                        batch = [(tuple(lengths) + cell, value) for cell, value in zip(todo, values.tolist())]
+                        known.update(batch)
+                        tally('evaluated', len(batch))
+                        tally('unreachable', int(np.isnan(values).sum()))
+                        if store is not None:
+                            store.add(batch)
+                evaluated = []
                 for iaa in range(area+1):
                     # for iab_tmp in range(1):
                             # iab = 3#area/2
@@ -106,24 +122,24 @@ def main():
                         # for iac in range(area):
                             # angles = [angles_orig[0]+step*iaa,angles_orig[1]+step*iab,angles_orig[2]+step*iac]
                             angles = [angles_orig[0]+step*iaa,angles_orig[1]+step*iab,90.0]
-                            logical  = DeltaPrinter(l, r, 0.01, a)
-                            physical = DeltaPrinter(lengths, r_orig+step*ir, 0.01, angles)
-                            nps = points_to_nozzle_positions(points, logical, physical)
-                            if nps is None:
-                                continue
-                            # print(nps)
-                            cds = get_center_distances(nps, adjustment)
-                            rds = get_round_distances(nps, adjustment)
-                            # print(cds)
-                            cur_error = 0.0
-                            for i in range(6):
-                                # cur_error += abs(observe_c[i]-cds[i])
-                                cur_error += (observe_c[i]-cds[i])*(observe_c[i]-cds[i])
-                                cur_error += (observe_r[i]-rds[i])*(observe_r[i]-rds[i])
+                            cell = tuple(lengths) + (angles[0], angles[1])
+                            if cell in known:
+                                cur_error = known[cell]
+                                if math.isnan(cur_error):
+                                    continue
+                            else:
+                                physical = DeltaPrinter(lengths, [r1+step*ir for r1 in r_orig], 0.01, angles)
+                                nps = points_to_nozzle_positions(points, logical, physical)
+                                if nps is None:
+                                    evaluated.append((cell, math.nan))
+                                    continue
+                                # print(nps)
+                                cur_error = distances_error(nps, observe_c, observe_r, adjustment)
+                                evaluated.append((cell, cur_error))
                             if cur_error < min_error:
                                 solution_l = list(lengths)
                                 solution_a = list(angles)
-                                solution_r = r_orig+step*ir
+                                solution_r = [r1+step*ir for r1 in r_orig]
                                 min_error = cur_error
                                 print(solution_l)
                                 print(solution_a)
@@ -131,11 +147,117 @@ def main():
                                 print(min_error)
                             # else:
                             #     print(cur_error)
+                if evaluated:
+                    tally('evaluated', len(evaluated))
+                    tally('unreachable', sum(1 for cell, value in evaluated if math.isnan(value)))
+                if store is not None:
+                    store.add(evaluated)
+
+    return solution_l, solution_a, solution_r, min_error
+
+# Solver mode, bounded least squares over rod lengths and tower A/B angles (tower C stays at 90),
+# same search box and same error as the exhaustive mode. Needs scipy, unlike the rest of the tool.
+def solve(points, l, r, a, observe_c, observe_r, adjustment, step, area, starts = 8, polish = False):
+    from scipy.optimize import least_squares
+
+    logical = DeltaPrinter(l, r, 0.01, a)
+    logical.home()
+    logical_steps = logical.move_many(points)
+    observed = np.array(observe_c[:6] + observe_r[:6])
+
+    def nozzle_positions(params):
+        physical = DeltaPrinter(list(params[0:3]), r, 0.01, [params[3], params[4], 90.0])
+        nps, intersect = physical.nozzle_positions(logical_steps)
+        return nps if intersect.all() else None
+
+    def residuals(params):
+        nps = nozzle_positions(params)
+        if nps is None:
+            return np.full(12, 1e3)
+        center = np.hypot(nps[1:,0]-nps[0,0], nps[1:,1]-nps[0,1]) + adjustment
+        shifted = np.roll(nps[1:], -1, axis=0)
+        round = np.hypot(nps[1:,0]-shifted[:,0], nps[1:,1]-shifted[:,1]) + adjustment
+        return observed - np.concatenate((center[:6], round[:6]))
+
+    center = np.array(l + a[0:2])
+    lower = center - area/2*step
+    upper = center + area/2*step
+
+    rng = np.random.default_rng(0)
+    guesses = [center] + [rng.uniform(lower, upper) for i in range(starts-1)]
+    best = None
+    for guess in guesses:
+        result = least_squares(residuals, guess, bounds=(lower, upper), x_scale=step, diff_step=1e-6)
+        if best is None or result.cost < best.cost:
+            best = result
+    solution = best.x
+    min_error = 2*best.cost
+
+    if polish:
+        # walk the exhaustive grid from the nearest grid node until no neighbour is better
+        solution = lower + np.clip(np.round((solution-lower)/step), 0, area)*step
+        min_error = np.sum(residuals(solution)**2)
+        moved = True
+        while moved:
+            moved = False
+            for offset in itertools.product([-1, 0, 1], repeat=5):
+                candidate = np.clip(solution + np.array(offset)*step, lower, upper)
+                cur_error = np.sum(residuals(candidate)**2)
+                if cur_error < min_error:
+                    solution, min_error, moved = candidate, cur_error, True
+
+    return [float(v) for v in solution[0:3]], [float(solution[3]), float(solution[4]), 90.0], r, float(min_error)
+
+def main():
+
+    # search space parameters
+    step = 0.1
+    area = 10
+
+    distances = 45 # expected distances between the centers
+    adjustment = 3.8 # pin/bolt head diameter
+    da = distances + adjustment
+
+    parser = argparse.ArgumentParser(description='Delta errors simulation')
+    parser.add_argument('-l','--l-value',type=str,default="120.8",help='Diagonal rod lengths')
+    parser.add_argument('-r','--r-value',type=str,default="61.7",help='Delta radii')
+    parser.add_argument('-a','--a-value',type=str,default="210,330,90",help='Tower angles, in deg')
+    parser.add_argument('-cd','--cd-value',type=str,default="{0},{0},{0},{0},{0},{0}".format(da),help='Center distances')
+    parser.add_argument('-rd','--rd-value',type=str,default="{0},{0},{0},{0},{0},{0}".format(da),help='Round distances')
+    parser.add_argument('-m','--mode',type=str,default="exhaustive",choices=["exhaustive", "solve"],help='Exhaustive (reference) grid search or least squares solver, solver needs scipy')
+    parser.add_argument('-n','--starts',type=int,default=8,help='Number of solver starting points')
+    parser.add_argument('-p','--polish',action='store_true',help='Polish solver result on the exhaustive search grid')
+    parser.add_argument('-sc','--scalar',action='store_true',help='Exhaustive search evaluates printers one by one instead of in geometry batches')
+    parser.add_argument('-pf','--profile',type=str,nargs='?',const='summary',default=None,help='Print call counts and timings, or save cProfile stats to given file')
+    parser.add_argument('-db','--store',type=str,default=None,help='Keep exhaustive search errors in sweep store file, resumes and reuses earlier runs')
+    parser.add_argument('-b','--best',type=int,default=None,help='Print best N stored cells instead of searching, needs -db')
+    args = parser.parse_args()
+
+    l = parse_values(args.l_value)
+    r = parse_values(args.r_value)
+    a = parse_values(args.a_value)
+
+    observe_c = [float(cd) for cd in args.cd_value.split(',')]
+    observe_r = [float(rd) for rd in args.rd_value.split(',')]
+
+    points = get_points_wheel(distances, distances*10, 60.)
+
+    store = SweepStore(args.store, sweep_key(tool='find_correct2', l=l, r=r, a=a, observe_c=observe_c, observe_r=observe_r, adjustment=adjustment, points=distances)) if args.store else None
+    if args.best and store is None:
+        parser.error("-b needs -db")
+    if args.best:
+        for cell, e in store.best(args.best):
+            print("L{0}, A{1} - {2}".format(",".join(str(v) for v in cell[0:3]), ",".join(str(v) for v in cell[3:5]), e))
+        return
+
+    def run():
+        if args.mode == "exhaustive":
+            return exhaustive(points, l, r, a, observe_c, observe_r, adjustment, step, area, store, args.scalar)
+        return solve(points, l, r, a, observe_c, observe_r, adjustment, step, area, args.starts, args.polish)
+    solution = profile(args.profile, run)
 
-    print(solution_l)
-    print(solution_a)
-    print(solution_r)
-    print(min_error)
+    for value in solution:
+        print(value)
 
 if __name__ == '__main__':
     main()
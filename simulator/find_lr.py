@@ -2,10 +2,16 @@
 
 import sys
 import argparse
+import functools
 
-from delta_printer import DeltaPrinter, error
+import numpy as np
 
-def try_for(l, r, observations, error_treshold = 0.5, filter_for_flattness = True):
+from delta_printer import DeltaPrinter, error, errors, errors_many, move_cache
+from sweep import sweep, adaptive, f_range
+from store import SweepStore, sweep_key
+from instrument import profile, tally
+
+def try_for(l, r, observations, error_treshold = 0.5, filter_for_flattness = True, flat_points = None):
     # finds all L/R pairs that give correct dimensions, consumes observations
     max_error = 0
     for o in observations:
@@ -15,29 +21,66 @@ def try_for(l, r, observations, error_treshold = 0.5, filter_for_flattness = Tru
         observed_r = float(o[1])
         trial = DeltaPrinter(trial_l, trial_r)
         observed  = DeltaPrinter(observed_l, observed_r)
+        observed.cache = move_cache
+        observed.home()
 
         max_y = error(trial, observed, 0, 50)[1]
         min_y = error(trial, observed, 0, -50)[1]
         xy_error = (max_y - min_y) - float(o[2])
         if abs(xy_error) > error_treshold:
+            tally('rejected')
             return 100
         if abs(xy_error) > abs(max_error):
             max_error = xy_error
 
         if filter_for_flattness:
             center_error = error(trial, observed, 0, 0)[2]
-            for row in points:
-                for point in row:
-                    if point is not None:
-                        ep = error(trial, observed, point[0], point[1])[2] - center_error
-                        if abs(ep) > error_treshold:
-                            return 100
+            for point in grid_points if flat_points is None else flat_points:
+                ep = error(trial, observed, point[0], point[1])[2] - center_error
+                if abs(ep) > error_treshold:
+                    tally('rejected')
+                    return 100
     return max_error
 
-def f_range(start, end, step):
-    while start <= end:
-        yield start
-        start += step
+# Continuous counterpart of try_for() for adaptive search, <= 1 exactly when try_for() accepts L/R pair
+def cost_for(l, r, observations, error_treshold = 0.5, filter_for_flattness = True, flat_points = None):
+    cost = 0
+    for o in observations:
+        trial = DeltaPrinter(l, r)
+        observed  = DeltaPrinter(float(o[0]), float(o[1]))
+        observed.home()
+
+        # [0,50], [0,-50], [0,0], flatness points
+        nps, valid = errors(trial, observed, probe_points(flat_points) if filter_for_flattness else cost_points[:3])
+        # unreachable points, nothing is known about the cell (max() would drop NaN)
+        if not valid.all():
+            return np.nan
+        xy_error = (nps[0][1] - nps[1][1]) - float(o[2])
+        cost = max(cost, abs(xy_error) / error_treshold)
+        if filter_for_flattness:
+            cost = max(cost, abs(nps[3:,2] - nps[2][2]).max() / error_treshold)
+    return cost
+
+# Batch version of try_for() for cells (ls[k], rs[k]), all candidate printers are evaluated in one array pass
+# per observation. Cells with unreachable points are rejected (try_for() raises on them).
+def try_for_many(ls, rs, observations, error_treshold = 0.5, filter_for_flattness = True, flat_points = None):
+    ls = np.asarray(ls, dtype=float)
+    rs = np.asarray(rs, dtype=float)
+    max_error = np.zeros(len(ls))
+    rejected = np.zeros(len(ls), dtype=bool)
+    for o in observations:
+        observed  = DeltaPrinter(float(o[0]), float(o[1]))
+        observed.home()
+
+        # [0,50], [0,-50], [0,0], flatness points
+        nps, valid = errors_many(observed, probe_points(flat_points) if filter_for_flattness else cost_points[:2], ls[:,None], rs[:,None])
+        xy_error = (nps[:,0,1] - nps[:,1,1]) - float(o[2])
+        rejected |= ~valid.all(axis=1) | (abs(xy_error) > error_treshold)
+        if filter_for_flattness:
+            rejected |= (abs(nps[:,3:,2] - nps[:,2,None,2]) > error_treshold).any(axis=1)
+        max_error = np.where(abs(xy_error) > abs(max_error), xy_error, max_error)
+    tally('rejected', int(rejected.sum()))
+    return np.where(rejected, 100, max_error).tolist()
 
 points = [
     [None,         [-25, 43.3],  [0, 50],  [25, 43.3],  None],
@@ -47,8 +90,22 @@ points = [
     [None,         [-25, -43.3], [0, -50], [25, -43.3], None],
 ]
 
+# flatness is checked at points of the grid above, unless other points are given (e.g. by probe_points.py)
+grid_points = [point for row in points for point in row if point is not None]
+
+cost_points = np.array([[0, 50], [0, -50], [0, 0]] + grid_points)
+
+# [0,50], [0,-50], [0,0], flatness points
+def probe_points(flat_points = None):
+    return cost_points if flat_points is None else np.vstack((cost_points[:3], flat_points))
+
 # Example: ./find_lr.py -l 120.8 -r 61.7 -o '122.49,63.16,99;121.36,62.7,99.5' -f 1
 
+# searched L/R grid, cells with abs(try_for()) below match_limit are printed
+l_range = (117.0, 130.0)
+r_range = (60.0, 70.0)
+match_limit = 0.2
+
 def main():
 
     s_value = 0.05
@@ -57,6 +114,14 @@ def main():
     parser = argparse.ArgumentParser(description='Delta errors simulation')
     parser.add_argument('-s','--s-value',type=float,default=s_value,help='Step value')
     parser.add_argument('-f','--f-value',type=int,default=f_value,help='Filter for flatness')
+    parser.add_argument('-ad','--adaptive',action='store_true',help='Coarse-to-fine search instead of full grid')
+    parser.add_argument('-c','--coarse',type=int,default=16,help='Initial stride of adaptive search, in steps')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='Number of worker processes, defaults to number of cores')
+    parser.add_argument('-sc','--scalar',action='store_true',help='Evaluate cells one by one with try_for() instead of geometry-batched try_for_many()')
+    parser.add_argument('-pf','--profile',type=str,nargs='?',const='summary',default=None,help='Print call counts and timings, or save cProfile stats to given file; runs single process')
+    parser.add_argument('-db','--store',type=str,default=None,help='Keep evaluated cells in sweep store file, resumes and reuses earlier runs')
+    parser.add_argument('-b','--best',type=int,default=None,help='Print best N stored cells instead of sweeping, needs -db')
+    parser.add_argument('-pt','--points',type=str,default=None,help='Semicolon separated x,y points to check flatness at, as printed by probe_points.py')
     parser.add_argument('-o','--observations',type=str,dest='observations',default=None,help='Semicolon separated observation triplets, each in form or: l,r,dimension observed')
     args = parser.parse_args()
 
@@ -64,12 +129,34 @@ def main():
         print("Observations shall be provided")
         exit(1)
 
+    if args.profile:
+        args.jobs = 1
     observations = [x.split(",") for x in args.observations.split(";")]
-    for l in f_range(117.0, 130.0, args.s_value):
-        for r in f_range(60.0, 70.0, args.s_value):
-            e = try_for(l, r, observations, 0.1, args.f_value == 1)
-            if abs(e) < 0.2:
+    store = SweepStore(args.store, sweep_key(tool='find_lr', observations=observations, threshold=0.1, flatness=args.f_value == 1, **({'points': args.points} if args.points else {}))) if args.store else None
+    if args.best and store is None:
+        parser.error("-b needs -db")
+    if args.best:
+        for (l, r), e in store.best(args.best):
+            print("L{0}, R{1} - {2:.2f}".format(l, r, e))
+        return
+    flat_points = [[float(v) for v in p.split(',')] for p in args.points.split(';')] if args.points else None
+    evaluate = functools.partial(try_for, observations=observations, error_treshold=0.1, filter_for_flattness=args.f_value == 1, flat_points=flat_points)
+    batch = None if args.scalar else functools.partial(try_for_many, observations=observations, error_treshold=0.1, filter_for_flattness=args.f_value == 1, flat_points=flat_points)
+    def run():
+        if args.adaptive:
+            cost = functools.partial(cost_for, observations=observations, error_treshold=0.1, filter_for_flattness=args.f_value == 1, flat_points=flat_points)
+            matches, stats = adaptive(evaluate, cost, f_range(*l_range, args.s_value), f_range(*r_range, args.s_value), match_limit, args.coarse, jobs=args.jobs, store=store, batch=batch)
+            for l, r, e in matches:
                 print("L{0}, R{1} - {2:.2f}".format(l, r, e))
+            print("Evaluated {0} cost and {1} try_for of {2} grid cells".format(stats['cost'], stats['evaluate'], stats['grid']), file=sys.stderr)
+            return
+        for l, matches in sweep(evaluate, f_range(*l_range, args.s_value), f_range(*r_range, args.s_value), match_limit, args.jobs, store, batch):
+            for l, r, e in matches:
+                print("L{0}, R{1} - {2:.2f}".format(l, r, e), flush=True)
+    try:
+        profile(args.profile, run)
+    except KeyboardInterrupt:
+        exit(130)
 
 if __name__ == '__main__':
     main()
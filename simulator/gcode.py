@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import re
+
+# Minimal streaming G-code reader, enough to follow nozzle moves of a sliced print.
+# Understands G0/G1 (X, Y, Z, F), G90/G91 absolute/relative positioning, G92 position reset and G28 homing.
+
+word = re.compile(r'([A-Z])\s*(-?\d*\.?\d+)')
+
+# Yields (x, y, z, feedrate) of every G0/G1 move endpoint, feedrate in mm/s
+def read_moves(lines, start = (0., 0., 0.), feedrate = 50.):
+    position = list(start)
+    offset = [0., 0., 0.]   # machine position minus G-code position, set by G92
+    relative = False
+    for line in lines:
+        line = line.split(';', 1)[0].strip().upper()
+        if not line:
+            continue
+        words = word.findall(line)
+        if not words or words[0][0] != 'G':
+            continue
+        code = float(words[0][1])
+        values = dict((letter, float(value)) for letter, value in words[1:])
+        if code == 0 or code == 1:
+            if 'F' in values:
+                feedrate = values['F'] / 60.
+            moved = False
+            for axis, letter in enumerate('XYZ'):
+                if letter in values:
+                    position[axis] = position[axis] + values[letter] if relative else values[letter] + offset[axis]
+                    moved = True
+            if moved:
+                yield position[0], position[1], position[2], feedrate
+        elif code == 90:
+            relative = False
+        elif code == 91:
+            relative = True
+        elif code == 92:
+            for axis, letter in enumerate('XYZ'):
+                if letter in values:
+                    offset[axis] = position[axis] - values[letter]
+        elif code == 28:
+            position = list(start)
+            offset = [0., 0., 0.]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import functools
+import cProfile
+
+import numpy as np
+
+import delta_printer
+
+# Opt-in instrumentation of the kinematics hot path. enable() replaces DeltaPrinter methods and
+# module functions with counting/timing wrappers, nothing is wrapped (and nothing is paid) until then.
+# Times are inclusive, error() time contains its move() and nozzle_position() calls.
+# Tools add their own tallies (evaluated cells, matches) with tally(), a dict update per row or batch,
+# shared move() cache hits and misses are reported with them.
+#
+# Tools take --profile: "summary" prints the table below to stderr when done, anything else is a file
+# name for cProfile stats (pstats format, for `python -m pstats`, snakeviz or speedscope import).
+
+methods = ['__init__', 'home', 'move', 'move_many', 'nozzle_position', 'nozzle_positions']
+functions = ['error', 'errors', 'errors_many']
+
+# name -> [calls, seconds, raised, points, invalid points]
+stats = {}
+counts = {}
+started = None
+
+def tally(name, n = 1):
+    counts[name] = counts.get(name, 0) + n
+
+def timed(name, fn):
+    entry = stats.setdefault(name, [0, 0., 0, 0, 0])
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            # nozzle_position() raises when the spheres do not intersect
+            entry[2] += 1
+            raise
+        finally:
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+        # batch results are (positions, valid) pairs
+        if type(result) is tuple and len(result) == 2 and isinstance(result[1], np.ndarray):
+            entry[3] += result[1].size
+            entry[4] += result[1].size - np.count_nonzero(result[1])
+        return result
+    wrapper.instrumented = fn
+    return wrapper
+
+class TimedStream:
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.entry = stats.setdefault('print', [0, 0., 0, 0, 0])
+
+    def write(self, text):
+        start = time.perf_counter()
+        try:
+            return self.stream.write(text)
+        finally:
+            self.entry[0] += 1
+            self.entry[1] += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from subclasses(sub)
+
+def enable():
+    global started
+    if started is not None:
+        return
+    started = time.perf_counter()
+    for cls in [delta_printer.DeltaPrinter] + list(subclasses(delta_printer.DeltaPrinter)):
+        for name in methods:
+            if name in cls.__dict__:
+                setattr(cls, name, timed(cls.__name__ + "." + name, cls.__dict__[name]))
+    # tools import functions by name, replace every reference
+    for name in functions:
+        original = getattr(delta_printer, name)
+        wrapper = timed(name, original)
+        for module in list(sys.modules.values()):
+            if getattr(module, name, None) is original:
+                setattr(module, name, wrapper)
+    sys.stdout = TimedStream(sys.stdout)
+
+def report(file = sys.stderr):
+    elapsed = time.perf_counter() - started
+    print("Elapsed {0:.3f}s".format(elapsed), file=file)
+    print("{0:<34} {1:>10} {2:>10} {3:>10} {4:>12} {5:>10} {6:>10}".format("call", "count", "total s", "us/call", "calls/s", "raised", "invalid"), file=file)
+    for name, (calls, seconds, raised, points, invalid) in sorted(stats.items(), key=lambda s: -s[1][1]):
+        if calls:
+            print("{0:<34} {1:>10} {2:>10.3f} {3:>10.2f} {4:>12.0f} {5:>10} {6:>10}".format(name, calls, seconds, seconds/calls*1e6, calls/elapsed, raised, "{0}/{1}".format(invalid, points) if points else ""), file=file)
+    rows = dict(counts)
+    cache = delta_printer.move_cache
+    if cache.hits or cache.misses:
+        rows['move cache hits'] = cache.hits
+        rows['move cache misses'] = cache.misses
+    for name, n in sorted(rows.items()):
+        print("{0:<34} {1:>10} {2:>34.0f}/s".format(name, n, n/elapsed), file=file)
+
+# Runs fn() as --profile option says, see above
+def profile(option, fn):
+    if not option:
+        return fn()
+    if option == 'summary':
+        enable()
+        try:
+            return fn()
+        finally:
+            report()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn)
+    finally:
+        profiler.dump_stats(option)
+        print("Profile saved to file:\n" + option, file=sys.stderr)
@@ -1,29 +1,92 @@
 #!/usr/bin/env python3
 
 import sys
+import os
+import argparse
+import hashlib
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 import math
 
-from scipy import interpolate
-from scipy.interpolate import griddata
-
-def plot(titles, input_data, output_file = None, show_window = True, note = None, invert = False):
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
+
+from common import get_points_wheel
+
+# Plot input is (N,3) array of x,y,value rows, or file name/stream of such rows in CSV or .npy format
+def load(data):
+    if isinstance(data, np.ndarray):
+        return data[:,0], data[:,1], data[:,2]
+    if isinstance(data, str) and data.endswith(".npy"):
+        return load(np.load(data))
+    return np.loadtxt(data, delimiter=',', unpack=True)
+
+# Returns (titles, panels) of a plot input file, as sim_warp.py save() writes them: .npz has one (N,3) array
+# per panel named by its title, .npy a single (N,3) array or a (panels,N,3) stack, CSV a single panel
+def read_panels(file_name):
+    if file_name.endswith(".npz"):
+        with np.load(file_name) as arrays:
+            return list(arrays.files), [arrays[name] for name in arrays.files]
+    if file_name.endswith(".npy"):
+        data = np.load(file_name)
+        if data.ndim == 3:
+            return ["Z{0}".format(i+1) for i in range(len(data))], list(data)
+        return ["Z"], [data]
+    return ["Z"], [file_name]
+
+# Delaunay triangulations by point set, shared by panels and by later plots of the same points,
+# least recently used ones are dropped beyond triangulations_kept (long running daemon plots many sets)
+triangulations = {}
+triangulations_kept = 8
+
+def triangulation(X, Y):
+    points = np.column_stack((X, Y))
+    key = hashlib.sha1(points.tobytes()).hexdigest()
+    result = triangulations.pop(key, None)
+    if result is None:
+        result = Delaunay(points)
+    triangulations[key] = result
+    while len(triangulations) > triangulations_kept:
+        del triangulations[next(iter(triangulations))]
+    return result
+
+# Same as griddata(..., method='cubic') onto resolution x resolution grid, for several value columns at once
+def interpolate_grid(X, Y, Zs, resolution = 1000):
+    xi = np.linspace(X.min(),X.max(),resolution)
+    yi = np.linspace(Y.min(),Y.max(),resolution)
+    zi = CloughTocher2DInterpolator(triangulation(X, Y), np.column_stack(Zs))(xi[None,:], yi[:,None])
+    return xi, yi, zi
+
+def plot(titles, input_data, output_file = None, show_window = True, note = None, invert = False, resolution = 1000):
+
+    # panels sampled on the same points are interpolated together
+    panels = [load(data) for data in input_data]
+    groups = {}
+    for i, (X, Y, Z) in enumerate(panels):
+        groups.setdefault(hashlib.sha1(np.column_stack((X, Y)).tobytes()).hexdigest(), []).append(i)
+    grids = {}
+    for indexes in groups.values():
+        X, Y, Z = panels[indexes[0]]
+        xi, yi, zi = interpolate_grid(X, Y, [panels[i][2] for i in indexes], resolution)
+        for k, i in enumerate(indexes):
+            grids[i] = xi, yi, zi[:,:,k]
+
+    plot_grids(titles, [grids[i] for i in range(len(input_data))], output_file, show_window, note, invert)
+
+# Heatmaps of values already on regular grids, (xi, yi, zi) per panel with zi of shape (len(yi), len(xi)), NaN is not drawn
+def plot_grids(titles, grids, output_file = None, show_window = True, note = None, invert = False):
 
     plt.figure(1, figsize=(10,4.7))
+    plt.clf()
     if note is not None:
         plt.figtext(0.1, 0.1, note, bbox=dict(facecolor='gray', alpha=0.5))
 
-    for i in range(len(input_data)):
+    for i in range(len(grids)):
         plt.subplot(2, 3, i+1)
         plt.title(titles[i])
-        X, Y, Z = np.loadtxt(input_data[i], delimiter=',', unpack=True)
-
-        xi = np.linspace(X.min(),X.max(),1000)
-        yi = np.linspace(Y.min(),Y.max(),1000)
-        zi = griddata((X, Y), Z, (xi[None,:], yi[:,None]), method='cubic')
+        xi, yi, zi = grids[i]
         if invert:
             zi = -zi
 
@@ -37,6 +100,8 @@ def plot(titles, input_data, output_file = None, show_window = True, note = None
         plt.savefig(output_file)
     if show_window:
         plt.show()
+    else:
+        plt.close(1)
 
 def sparse(titles, input_data, output_file = None, show_window = True, note = None, invert = False):
 
@@ -47,7 +112,7 @@ def sparse(titles, input_data, output_file = None, show_window = True, note = No
     for i in range(len(input_data)):
         plt.subplot(2, 3, i+1)
         plt.title(titles[i])
-        X, Y, Z = np.loadtxt(input_data[i], delimiter=',', unpack=True)
+        X, Y, Z = load(input_data[i])
 
         zi = np.empty((100, 100))
         for i in range(len(X)):
@@ -64,26 +129,8 @@ def sparse(titles, input_data, output_file = None, show_window = True, note = No
         plt.savefig(output_file)
     if show_window:
         plt.show()
-
-def get_points_square(size):
-    points = [(0, 0)]
-    for x in range(size+1):
-        for y in range(size+1):
-            if x == 0 or x == int(size/2) or x == size or y == 0 or y == size or y == x or y == size - x:
-                points.append((int(x-size/2),int(y-size/2)))
-    return points
-
-
-def get_points_wheel(max_dist = 50, scatter_step = 5, angle_step = 15.):
-    points = [(0, 0)]
-    scatter = [x/100 for x in range(100, 5, -scatter_step)]
-    for i in range(len(scatter)):
-        dist = max_dist * scatter[i]
-        for j in range(int(360/angle_step)):
-            r = math.radians(90. + angle_step * j)
-            points.append((math.cos(r) * dist, math.sin(r) * dist))
-    return points
-
+    else:
+        plt.close(1)
 
 def scatter(titles, input_data, output_file = None, show_window = True, note = None, invert = False):
 
@@ -96,7 +143,7 @@ def scatter(titles, input_data, output_file = None, show_window = True, note = N
     for i in range(len(input_data)):
         plt.subplot(1, 1, i+1)
         plt.title(titles[i])
-        X, Y, Z = np.loadtxt(input_data[i], delimiter=',', unpack=True)
+        X, Y, Z = load(input_data[i])
 
         # zi = np.empty((100, 100))
         # for i in range(len(X)):
@@ -128,14 +175,14 @@ def scatter(titles, input_data, output_file = None, show_window = True, note = N
             idx1 = i+1
             idx2 = 0
             dist = math.hypot(X[idx1]-X[idx2],Y[idx1]-Y[idx2]) + 3.8
-            print("{2:.2f} - {0},{1}".format(X[idx1], Y[idx1], dist))
+            print("{2:.2f} - {0:.3f},{1:.3f}".format(X[idx1], Y[idx1], dist))
 
         print("Distances round: C-FarB, etc")
         for i in range(len(X)-1):
             idx1 = i+1
             idx2 = i+2 if i < len(X)-2 else 1
             dist = math.hypot(X[idx1]-X[idx2],Y[idx1]-Y[idx2]) + 3.8
-            print("{2:.2f} - {0},{1}".format(X[idx1], Y[idx1], dist))
+            print("{2:.2f} - {0:.3f},{1:.3f}".format(X[idx1], Y[idx1], dist))
 
 
     plt.subplots_adjust(top=0.92, bottom=0.08, left=0.10, right=0.95, hspace=0.25,
@@ -145,12 +192,34 @@ def scatter(titles, input_data, output_file = None, show_window = True, note = N
         plt.savefig(output_file)
     if show_window:
         plt.show()
+    else:
+        plt.close(1)
 
 
+# Examples:
+#   ./plot.py warp.csv
+#   ./plot.py -hl -d maps/ -res 300 runs/*.csv
 def main():
-    input_file = sys.argv[1]
-    # output_file = "{0}.png".format(sys.argv[1])
-    plot(["Z"], [input_file], None, True, str(sys.argv).replace("', '", " ").replace("['", "").replace("']", ""), True)
+    parser = argparse.ArgumentParser(description='Plot warp heatmap')
+    parser.add_argument('input',type=str,nargs='+',help='CSV, .npy or .npz files with x,y,value rows, as saved by sim_warp.py -o')
+    parser.add_argument('-res','--resolution',type=int,default=1000,help='Interpolation grid size')
+    parser.add_argument('-hl','--headless',action='store_true',help='Write PNG next to each input (or to --dir) instead of showing a window')
+    parser.add_argument('-d','--dir',type=str,default=None,help='Directory for headless PNG files')
+    args = parser.parse_args()
+
+    if args.headless:
+        plt.switch_backend('Agg')
+
+    for input_file in args.input:
+        output_file = None
+        if args.headless:
+            output_file = os.path.splitext(input_file)[0] + ".png"
+            if args.dir:
+                output_file = os.path.join(args.dir, os.path.basename(output_file))
+        titles, panels = read_panels(input_file)
+        plot(titles, panels, output_file, not args.headless, str(sys.argv).replace("', '", " ").replace("['", "").replace("']", ""), True, args.resolution)
+        if output_file:
+            print(output_file)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import sys
+import re
+import argparse
+import itertools
+
+import numpy as np
+
+from delta_printer import DeltaPrinter, errors, jacobian, jacobian_params, jacobian_columns
+from common import add_printer_arguments, printer_from_args
+
+# Streaming loader for Klipper probe data and saved height maps, and a linearized
+# geometry fit that consumes it chunk by chunk.
+#
+# Understood input, any mix of:
+#   probe results as printed by PROBE / DELTA_CALIBRATE / BED_MESH_CALIBRATE (klippy.log, OctoPrint terminal)
+#       // probe at 10.000,-5.000 is z=1.234567
+#   saved bed mesh from printer.cfg
+#       #*# [bed_mesh default]
+#       #*# points =
+#       #*#     0.010, 0.020, 0.030
+#       #*# x_count = 3 ... min_x = -30 ...
+#
+# Heights of different sources do not share a reference: mesh heights are relative to the mesh, probe heights
+# depend on homing, so every probe run (probe lines up to the next homing, G28) and every mesh gets its own offset.
+#
+# Examples:
+#   ./probe_data.py klippy.log -l 120.8 -r 61.7
+#   ssh pi@octopi cat printer_data/logs/klippy.log | ./probe_data.py - -l 120.8 -r 61.7 -p e0,e1,e2,r,a0,a1,l
+
+probe_line = re.compile(r'probe at (-?[\d.]+),\s*(-?[\d.]+) is z=(-?[\d.]+)')
+section_line = re.compile(r'^\[(.+)\]$')
+option_line = re.compile(r'^(\w+)\s*[=:]\s*(.*)$')
+homing_line = re.compile(r'\bG28\b')
+
+# Yields (x, y, z, source) samples from a stream of lines, sources are numbered in order of appearance
+def read_samples(lines):
+    sources = itertools.count()
+    run = None
+    mesh = None
+    mesh_rows = None
+    in_points = False
+    for line in lines:
+        match = probe_line.search(line)
+        if match:
+            if run is None:
+                run = next(sources)
+            yield float(match.group(1)), float(match.group(2)), float(match.group(3)), run
+            continue
+        if homing_line.search(line):
+            run = None
+            continue
+
+        # saved config lines are prefixed with #*#
+        line = line.strip()
+        if not line.startswith('#*#'):
+            continue
+        line = line[3:].strip()
+        match = section_line.match(line)
+        if match:
+            if mesh is not None:
+                yield from mesh_samples(mesh, mesh_rows, next(sources))
+            mesh = {} if match.group(1).startswith('bed_mesh') else None
+            mesh_rows = None
+            in_points = False
+            continue
+        if mesh is None:
+            continue
+        match = option_line.match(line)
+        if match:
+            in_points = match.group(1) == 'points'
+            if in_points:
+                mesh_rows = []
+            mesh[match.group(1)] = match.group(2)
+        elif in_points and line:
+            mesh_rows.append([float(v) for v in line.split(',') if v.strip()])
+    if mesh is not None:
+        yield from mesh_samples(mesh, mesh_rows, next(sources))
+
+def mesh_samples(mesh, rows, source):
+    if not rows or 'min_x' not in mesh:
+        return
+    xs = np.linspace(float(mesh['min_x']), float(mesh['max_x']), len(rows[0]))
+    ys = np.linspace(float(mesh['min_y']), float(mesh['max_y']), len(rows))
+    for y, row in zip(ys, rows):
+        for x, z in zip(xs, row):
+            yield float(x), float(y), z, source
+
+# Groups samples into (N,4) arrays of at most `size` rows
+def read_chunks(lines, size = 4096):
+    chunk = []
+    for sample in read_samples(lines):
+        chunk.append(sample)
+        if len(chunk) == size:
+            yield np.array(chunk)
+            chunk = []
+    if chunk:
+        yield np.array(chunk)
+
+# Least squares estimate of physical geometry deviations from probed heights, linearized around
+# the firmware geometry. Probe triggers where actual nozzle height meets the bed, so a probed z
+# is minus the nozzle z error, plus an unknown constant offset (probe offset, bed height) per source.
+# Only normal equations are kept, so any number of samples can be added in chunks.
+# Heights do not show the towers moving together in XY, so per-tower radii and angles are not all
+# identifiable, the common part of endstops goes to the offsets; damping keeps such combinations near zero.
+class ProbeFit:
+
+    def __init__(self, logical, params = jacobian_params):
+        self.logical = logical
+        self.physical = DeltaPrinter.from_geometry(logical.geometry)
+        self.columns = jacobian_columns(params)
+        self.params = list(params)
+        size = len(self.params)
+        self.ata = np.zeros((size, size))
+        self.atb = np.zeros(size)
+        self.btb = 0.
+        self.count = 0
+        self.skipped = 0
+        self.sources = 0
+
+    # one offset column per source, added as sources show up
+    def grow(self, sources):
+        if sources > self.sources:
+            extra = sources - self.sources
+            self.ata = np.pad(self.ata, ((0, extra), (0, extra)))
+            self.atb = np.pad(self.atb, (0, extra))
+            self.sources = sources
+
+    # samples are (N,4) x, y, z, source rows, or (N,3) rows of a single source
+    def add(self, samples):
+        sources = samples[:,3].astype(int) if samples.shape[1] > 3 else np.zeros(len(samples), dtype=int)
+        self.grow(sources.max() + 1)
+        J, valid = jacobian(self.physical, self.logical, samples[:,0:2])
+        nps = errors(self.physical, self.logical, samples[:,0:2])[0]
+        n = int(valid.sum())
+        a = np.zeros((n, len(self.params) + self.sources))
+        a[:,0:len(self.params)] = -J[valid][:,2] @ self.columns
+        a[np.arange(n), len(self.params) + sources[valid]] = 1.
+        b = samples[valid,2] + nps[valid,2]
+        self.ata += a.T @ a
+        self.atb += a.T @ b
+        self.btb += b @ b
+        self.count += n
+        self.skipped += int((~valid).sum())
+
+    # Returns ({param: deviation}, [offset per source], rms residual), damping keeps degenerate parameters near zero
+    def solve(self, damping = 1e-3):
+        size = self.ata.shape[0]
+        x = np.linalg.solve(self.ata + damping*np.eye(size), self.atb)
+        rss = self.btb - 2*x @ self.atb + x @ self.ata @ x
+        rms = np.sqrt(max(rss, 0.) / self.count) if self.count else float('nan')
+        count = len(self.params)
+        return dict(zip(self.params, x[:count])), list(x[count:]), rms
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit delta geometry to Klipper probe data')
+    parser.add_argument('input',type=str,nargs='?',default='-',help='Log or printer.cfg file, - for stdin')
+    add_printer_arguments(parser, 'Firmware')
+    parser.add_argument('-p','--params',type=str,default='e0,e1,e2,r,a0,a1',help='Geometry parameters to fit, of: ' + ','.join(jacobian_params) + ', or l, r, a, e for all towers at once')
+    parser.add_argument('-c','--chunk',type=int,default=4096,help='Samples per chunk')
+    parser.add_argument('-d','--damping',type=float,default=1e-3,help='Damping of the least squares solution')
+    args = parser.parse_args()
+
+    logical = printer_from_args(args)
+    fit = ProbeFit(logical, args.params.split(','))
+
+    stream = sys.stdin if args.input == '-' else open(args.input)
+    with stream:
+        for chunk in read_chunks(stream, args.chunk):
+            fit.add(chunk)
+
+    if fit.count == 0:
+        print("No probe samples found")
+        exit(1)
+
+    deviations, offsets, rms = fit.solve(args.damping)
+    print("Samples: {0}, skipped: {1}, sources: {2}".format(fit.count, fit.skipped, fit.sources))
+    for param, value in deviations.items():
+        print("{0}: {1:+.3f}".format(param, value))
+    for source, offset in enumerate(offsets):
+        print("Offset {0}: {1:+.3f}".format(source, offset))
+    print("RMS residual: {0:.4f}".format(rms))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+import numpy as np
+
+from delta_printer import DeltaPrinter, jacobian, jacobian_params, jacobian_columns
+from common import add_printer_arguments, printer_from_args
+
+# Picks few probe points that still identify the geometry, greedy D-optimal design:
+# every measured point adds its rows of error sensitivities (jacobian()) to the information matrix,
+# starting from a Gaussian prior on the parameters, the point adding most information (log det) is
+# taken next, until posterior standard deviation of every parameter is below the target.
+#
+# Probing measures nozzle height only, with unknown probe offset, so an offset term is estimated too
+# and endstops are identified relative to each other (their common part is the offset), as in probe_data.py.
+# Heights can not tell per-tower radii apart from moving all towers, so by default one radius is identified
+# together with endstops and two tower angles, as Klipper DELTA_CALIBRATE does.
+# Measurement "xyz" adds X/Y errors, as measured on printed objects for find_lr/find_correct2.
+#
+# Output is "x,y;x,y;..." points for find_lr -pt, or a Klipper G-code probing script whose log lines
+# (probe at X,Y is z=Z) are read by probe_data.py.
+#
+# Examples:
+#   ./probe_points.py
+#   ./probe_points.py -R 30 -f gcode > probe.gcode
+#   ./probe_points.py -p l0,l1,l2,r,a0,a1,e0,e1,e2 -m xyz
+
+def candidates(radius, spacing):
+    n = int(radius // spacing)
+    grid = np.arange(-n, n+1) * spacing
+    x, y = np.meshgrid(grid, grid)
+    points = np.column_stack((x.ravel(), y.ravel()))
+    return points[np.hypot(points[:,0], points[:,1]) <= radius + 1e-9]
+
+# Returns (N, rows, params + offset) sensitivities of measured values to parameter deviations,
+# and mask of points reachable by the printer
+def sensitivities(logical, points, params, measure = 'z'):
+    physical = DeltaPrinter.from_geometry(logical.geometry)
+    J, valid = jacobian(physical, logical, points)
+    rows = [2] if measure == 'z' else [0, 1, 2]
+    a = np.zeros((len(points), len(rows), len(params) + 1))
+    a[:,:,:-1] = J[:,rows] @ jacobian_columns(params)
+    a[:,rows.index(2),-1] = 1.
+    return a, valid
+
+# Rows of parameter combinations the targets apply to: parameters themselves,
+# endstops relative to their mean as their common part can not be told from the offset
+def contrasts(params):
+    size = len(params) + 1
+    t = np.eye(size)[:-1]
+    endstops = [i for i, p in enumerate(params) if p in ['e0', 'e1', 'e2']]
+    if len(endstops) > 1:
+        for i in endstops:
+            t[i, endstops] -= 1./len(endstops)
+    return t
+
+def deviations(covariance, t):
+    return np.sqrt(np.einsum('ij,jk,ik->i', t, covariance, t))
+
+# Greedy selection, returns indices of picked candidates and standard deviations after each pick
+def select(a, prior, noise, targets, t, max_points):
+    covariance = np.diag(np.asarray(prior, dtype=float)**2)
+    picked = []
+    history = [deviations(covariance, t)]
+    available = np.ones(len(a), dtype=bool)
+    k = a.shape[1]
+    while len(picked) < max_points and (history[-1] > targets).any() and available.any():
+        # information gain log det(I + A C A^T / noise^2) of every candidate
+        s = np.einsum('nip,pq,njq->nij', a, covariance, a) / noise**2 + np.eye(k)
+        gain = np.linalg.slogdet(s)[1]
+        gain[~available] = -np.inf
+        best = int(np.argmax(gain))
+        picked.append(best)
+        available[best] = False
+        # posterior covariance update, C - C A^T (noise^2 I + A C A^T)^-1 A C
+        ca = covariance @ a[best].T
+        covariance = covariance - ca @ np.linalg.solve(noise**2 * np.eye(k) + a[best] @ ca, ca.T)
+        history.append(deviations(covariance, t))
+    return picked, history
+
+def gcode(points, z = 5., feedrate = 3000):
+    lines = ["G28"]
+    for x, y in points:
+        lines.append("G1 Z{0:.1f} F{1}".format(z, feedrate))
+        lines.append("G1 X{0:.3f} Y{1:.3f} F{2}".format(x, y, feedrate))
+        lines.append("PROBE")
+    lines.append("G1 Z{0:.1f} F{1}".format(z, feedrate))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Optimal probe point selection')
+    add_printer_arguments(parser)
+    parser.add_argument('-p','--params',type=str,default='e0,e1,e2,r,a0,a1',help='Geometry parameters to identify, of: ' + ','.join(jacobian_params) + ', or l, r, a, e for all towers at once')
+    parser.add_argument('-m','--measure',type=str,default='z',choices=['z', 'xyz'],help='Measured errors, z for probing')
+    parser.add_argument('-R','--radius',type=float,default=30.,help='Probeable radius, in mm (delta_calibrate radius)')
+    parser.add_argument('-g','--spacing',type=float,default=2.5,help='Candidate grid spacing, in mm')
+    parser.add_argument('-n','--noise',type=float,default=0.01,help='Measurement noise (probe repeatability), in mm')
+    parser.add_argument('-t','--target',type=float,default=0.05,help='Target standard deviation of lengths, radii and endstops, in mm')
+    parser.add_argument('-ta','--target-angle',type=float,default=0.1,help='Target standard deviation of tower angles, in deg')
+    parser.add_argument('-P','--prior',type=float,default=1.,help='Prior standard deviation of parameters, in mm or deg')
+    parser.add_argument('-mp','--max-points',type=int,default=50,help='Maximum number of points')
+    parser.add_argument('-f','--format',type=str,default='points',choices=['points', 'gcode'],help='Output semicolon separated points or Klipper probing G-code')
+    args = parser.parse_args()
+
+    logical = printer_from_args(args)
+    params = args.params.split(',')
+
+    points = candidates(args.radius, args.spacing)
+    a, valid = sensitivities(logical, points, params, args.measure)
+    points, a = points[valid], a[valid]
+
+    # probe offset is not known at all
+    prior = [args.prior]*len(params) + [100.]
+    targets = np.array([args.target_angle if p[0] == 'a' else args.target for p in params])
+    t = contrasts(params)
+
+    # parameters that all candidates together can not pin down are reported and not waited for
+    information = np.diag(1./np.array(prior)**2) + np.einsum('nip,niq->pq', a, a) / args.noise**2
+    everything = deviations(np.linalg.inv(information), t)
+    unreachable = everything > targets
+    for p, std in zip(np.array(params)[unreachable], everything[unreachable]):
+        print("{0} can not get below {1:.4f} with all {2} candidates".format(p, std, len(a)), file=sys.stderr)
+    targets[unreachable] = np.inf
+
+    picked, history = select(a, prior, args.noise, targets, t, args.max_points)
+    print("{0} points of {1} candidates".format(len(picked), len(a)), file=sys.stderr)
+    if (history[-1] > targets).any():
+        print("Targets are not reached with {0} points".format(args.max_points), file=sys.stderr)
+    for p, std in zip(params, history[-1]):
+        print("{0}: {1:.4f}".format(p, std), file=sys.stderr)
+
+    picked = points[picked]
+    if args.format == 'gcode':
+        print(gcode(picked))
+    else:
+        print(";".join("{0:g},{1:g}".format(x, y) for x, y in picked))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import itertools
+
+import numpy as np
+
+from delta_printer import error
+from gcode import read_moves
+from common import add_geometry_arguments, printers_from_args
+
+# Replays sliced G-code through firmware-believed (wrong) and physical (correct) printers,
+# like sim_warp does for a point pattern, and reports per-layer dimensional deviation.
+# G-code is streamed and move endpoints are evaluated in chunks, memory does not grow with file size.
+#
+# Examples:
+#   ./replay.py part.gcode -l 123.5 -r 63.7 -wl 120 -wr 62.7
+#   ./replay.py part.gcode -l 120.8,121,120.5 -a 210.2,330,90 -csv > layers.csv
+#   ./replay.py part.gcode -t warp.npy
+
+# With an ErrorTable, errors are interpolated from it and the printers are not used, moves beyond
+# table bounds are counted as outside (not unreachable, the table does not know) and skipped
+def replay(moves, correct, wrong, chunk = 65536, table = None):
+    if table is None:
+        center_error = error(correct, wrong, 0, 0)[2] # glue good and bad centers together
+    else:
+        center_error = table.lookup(np.zeros((1, 3)))[0,2]
+    layers = {}
+    unreachable = 0
+    outside = 0
+    moves = iter(moves)
+    while True:
+        block = np.array(list(itertools.islice(moves, chunk)))
+        if len(block) == 0:
+            break
+        points = block[:,0:3]
+        if table is None:
+            nozzle_positions, intersect = correct.nozzle_positions(wrong.move_many(points))
+            deviation = nozzle_positions - points
+            beyond = np.zeros(len(points), dtype=bool)
+        else:
+            deviation = table.lookup(points)
+            intersect = ~np.isnan(deviation[:,0])
+            beyond = table.outside(points)
+        outside += int(beyond.sum())
+        unreachable += int((~intersect & ~beyond).sum())
+        points = points[intersect]
+        deviation = deviation[intersect]
+        xy = np.hypot(deviation[:,0], deviation[:,1])
+        z = np.abs(deviation[:,2] - center_error)
+        heights, index = np.unique(np.round(points[:,2], 3), return_inverse=True)
+        max_xy = np.zeros(len(heights))
+        max_z = np.zeros(len(heights))
+        np.maximum.at(max_xy, index, xy)
+        np.maximum.at(max_z, index, z)
+        counts = np.bincount(index, minlength=len(heights))
+        for height, count, layer_xy, layer_z in zip(heights, counts, max_xy, max_z):
+            layer = layers.setdefault(float(height), [0, 0., 0.])
+            layer[0] += int(count)
+            layer[1] = max(layer[1], float(layer_xy))
+            layer[2] = max(layer[2], float(layer_z))
+    return layers, unreachable, outside
+
+def main():
+    parser = argparse.ArgumentParser(description='G-code dimensional error prediction')
+    parser.add_argument('input',type=str,nargs='?',default='-',help='G-code file, - for stdin')
+    add_geometry_arguments(parser)
+    parser.add_argument('-c','--chunk',type=int,default=65536,help='Moves evaluated at once')
+    parser.add_argument('-t','--table',type=str,default=None,help='Use precomputed error table (see error_table.py) instead of geometry options')
+    parser.add_argument('-csv','--csv',action='store_true',help='Print layers as CSV')
+    args = parser.parse_args()
+
+    correct, wrong = printers_from_args(args)
+    table = None
+    if args.table:
+        from error_table import ErrorTable
+        table = ErrorTable.load(args.table)
+
+    stream = sys.stdin if args.input == '-' else open(args.input)
+    with stream:
+        layers, unreachable, outside = replay(read_moves(stream), correct, wrong, args.chunk, table)
+
+    if args.csv:
+        print("z,moves,max_xy,max_z")
+    else:
+        print("{0:>8} {1:>8} {2:>10} {3:>10}".format("Z", "moves", "max XY", "max Z"))
+    for height in sorted(layers):
+        count, max_xy, max_z = layers[height]
+        if args.csv:
+            print("{0:.3f},{1},{2:.4f},{3:.4f}".format(height, count, max_xy, max_z))
+        else:
+            print("{0:>8.3f} {1:>8} {2:>10.4f} {3:>10.4f}".format(height, count, max_xy, max_z))
+
+    if layers:
+        print("Overall max XY: {0:.4f}mm, max Z: {1:.4f}mm".format(max(l[1] for l in layers.values()), max(l[2] for l in layers.values())), file=sys.stderr)
+    if unreachable:
+        print("Unreachable moves: {0}".format(unreachable), file=sys.stderr)
+    if outside:
+        print("Moves outside of table: {0}, not evaluated, rebuild it with larger radius or z range".format(outside), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
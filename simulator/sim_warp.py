@@ -3,117 +3,56 @@
 import sys
 import argparse
 
-import math
-from scipy.spatial import distance
+import numpy as np
 
-from io import StringIO
+from delta_printer import error
+from common import get_points_wheel, add_geometry_arguments, printers_from_args
 
-from delta_printer import DeltaPrinter, error
-
-from plot import plot, sparse, scatter
+# plot.py (matplotlib, scipy) is imported only when plotting, numeric modes start much faster
 
 # Examples:
 # ./sim_warp.py -l 123.5 -r 63.7 -wl 120 -wr 62.7
-
-# horizontal, vertical and diagonal lines
-def get_points_square(size):
-    points = [(0, 0)]
-    for x in range(size+1):
-        for y in range(size+1):
-            if x == 0 or x == int(size/2) or x == size or y == 0 or y == size or y == x or y == size - x:
-                points.append((int(x-size/2),int(y-size/2)))
-    return points
-
-
-def get_points_wheel(max_dist = 50, scatter_step = 5, angle_step = 15.):
-    points = [(0, 0)]
-    scatter = [x/100 for x in range(100, 5, -scatter_step)]
-    for i in range(len(scatter)):
-        dist = max_dist * scatter[i]
-        for j in range(int(360/angle_step)):
-            r = math.radians(90. + angle_step * j)
-            #points.append((int(math.cos(r) * dist), int(math.sin(r) * dist)))
-            points.append((math.cos(r) * dist, math.sin(r) * dist))
-    return points
+# ./sim_warp.py -l 123.5 -r 63.7 -wl 120 -wr 62.7 -pt 0,50
+# ./sim_warp.py -l 123.5 -r 63.7 -wl 120 -wr 62.7 -v heatmaps -np > warp.csv
 
 def main():
 
-    l_value = "120.8"
-    r_value = "61.7"
-
     parser = argparse.ArgumentParser(description='Delta errors simulation')
-
-    parser.add_argument('-l','--l-value',type=str,default=l_value,help='Correct l-value')
-    parser.add_argument('-r','--r-value',type=str,default=r_value,help='Correct r-value')
-    parser.add_argument('-s','--s-value',type=float,default=0.01,help='Correct step size, in mm')
-    parser.add_argument('-a','--a-value',type=str,default="210,330,90",help='Correct tower angles, in deg')
-
-    parser.add_argument('-wl','--wl-value',type=str,default=l_value,help='Wrong l-value')
-    parser.add_argument('-wr','--wr-value',type=str,default=r_value,help='Wrong r-value')
-    parser.add_argument('-ws','--ws-value',type=float,default=None,help='Wrong step size, in mm')
-    parser.add_argument('-wa','--wa-value',type=str,default=None,help='Wrong tower angles, in deg')
-
-    parser.add_argument('-we','--we-value',type=str,default="0",help='Wrong endstops')
+    add_geometry_arguments(parser)
 
     parser.add_argument('-v','--v-value',type=str,default="wheel",help='Visualization type')
+    parser.add_argument('-o','--output',type=str,default=None,help='Save results to .npy, .npz or .csv file')
+    parser.add_argument('-png','--png',type=str,default=None,help='Save plot to PNG file')
+    parser.add_argument('-hl','--headless',action='store_true',help='Do not show plot window')
+    parser.add_argument('-res','--resolution',type=int,default=1000,help='Heatmap interpolation grid size')
+    parser.add_argument('-np','--no-plot',action='store_true',help='Do not plot, print results as CSV unless saved with -o')
+    parser.add_argument('-pt','--point',type=str,default=None,help='Print nozzle error at single X,Y point and exit')
     # parser.add_argument('-save','--save-value',type=str,default="sim_warp.png",help='Save plot to file with name')
     args = parser.parse_args()
 
-    if args.ws_value is None:
-        args.ws_value = args.s_value
-    if args.wa_value is None:
-        args.wa_value = args.a_value
-
-    correct_l = [float(l) for l in args.l_value.split(',')] if "," in args.l_value else [float(args.l_value) for x in range(3)]
-    correct_r = [float(r) for r in args.r_value.split(',')] if "," in args.r_value else [float(args.r_value) for x in range(3)]
-    correct_a = [float(a) for a in args.a_value.split(',')]
-    correct_e = [0.,0.,0.]
-
-    wrong_l = [float(l) for l in args.wl_value.split(',')] if "," in args.wl_value else [float(args.wl_value) for x in range(3)]
-    wrong_r = [float(r) for r in args.wr_value.split(',')] if "," in args.wr_value else [float(args.wr_value) for x in range(3)]
-    wrong_a = [float(a) for a in args.wa_value.split(',')]
-    wrong_e = [float(e) for e in args.we_value.replace("#","-").split(',')] if "," in args.we_value else [float(args.we_value.replace("#","-")) for x in range(3)]
+    correct, wrong = printers_from_args(args)
 
+    center_error = error(correct, wrong, 0, 0)[2] # glue good and bad centers together
 
-    # print(correct_l)
-    # print(wrong_l)
-    # print(args.s_value)
+    if args.point:
+        x, y = [float(v) for v in args.point.split(',')]
+        nozzle_position = error(correct, wrong, x, y)
+        print("{0:.4f},{1:.4f},{2:.4f}".format(nozzle_position[0] - x, nozzle_position[1] - y, nozzle_position[2] - center_error))
+        return
 
-    correct = DeltaPrinter(correct_l, correct_r, args.s_value, correct_a, correct_e)
-    wrong  = DeltaPrinter(wrong_l, wrong_r, args.ws_value, wrong_a, wrong_e)
-    # lean on wrong printer is always 90, i.e. it thinks it's correct. NB! lean does not work now anyway
+    viz = args.v_value
 
-    # correct.home()
-    wrong.home()
+    titles = ["X","Y","Z"] if viz == "heatmaps" else ["COORDS"]
 
-    center_error = error(correct, wrong, 0, 0)[2] # glue good and bad centers together
+    points = get_points_wheel(45, 5, 15.) if viz == "heatmaps" else get_points_wheel(45, 100, 60.)
 
-    viz = args.v_value
+    nozzle_positions = correct.nozzle_positions(wrong.move_many(points))[0]
 
-    csv = ["","",""] if viz == "heatmaps" else [""]
-
-    points = []
     if viz == "heatmaps":
-        points.extend(get_points_wheel(45, 5, 15.))
+        err = nozzle_positions - np.hstack((points, np.full((len(points), 1), center_error))) # sign matches direction of shift
+        data = [np.column_stack((points, err[:,i])) for i in range(3)]
     else:
-        points.extend(get_points_wheel(45, 100, 60.))
-
-    for point in points:
-        x = point[0]
-        y = point[1]
-        wrong.move(x, y)
-        correct.tower_steps = [s for s in wrong.tower_steps]
-        nozzle_position = correct.nozzle_position()
-
-        if viz == "heatmaps":
-            err = [0,0,0]
-            err[0] =  nozzle_position[0] - point[0]              # sign matches direction of shift
-            err[1] =  nozzle_position[1] - point[1]              # sign matches direction of shift
-            err[2] =  nozzle_position[2] - center_error          # sign matches direction of shift
-            for i in range(3):
-                csv[i] += "{0:.3f},{1:.3f},{2:.3f}\n".format(x,y,err[i])
-        else:
-            csv[0] += "{0:.3f},{1:.3f},{2:.3f}\n".format(nozzle_position[0],nozzle_position[1],nozzle_position[2])
+        data = [nozzle_positions]
 
     # max_y = error(correct, wrong, 0, 50)[1]
     # min_y = error(correct, wrong, 0, -50)[1]
@@ -123,19 +62,40 @@ def main():
 
     # print("")
 
-    # FIXME different args for different filenames
-    # csv = StringIO(z_csv)
-    # png = "{0}-{1}-with-{2}_{3}_z.png".format(correct_l, correct_r, wrong_l, wrong_r) if args.save_value == "generate" else args.save_value
-    # print("Plot saved to file:\n" + png)
-    # plot(csv, png, True)
-
-    data = [StringIO(csv[i]) for i in range(len(csv))]
-    # png = "{0}-{1}-with-{2}_{3}_xy.png".format(correct_l, correct_r, wrong_l, wrong_r) if args.save_value == "generate" else args.save_value
-    # print("Plot saved to file:\n" + png)
+    if args.output:
+        save(args.output, titles, data)
+        print("Data saved to file:\n" + args.output)
+
+    if args.no_plot:
+        if not args.output:
+            for title, values in zip(titles, data):
+                if len(data) > 1:
+                    print("# " + title)
+                np.savetxt(sys.stdout, values, fmt="%.4f", delimiter=",")
+        return
+
+    from plot import plot, scatter, plt
+    if args.headless:
+        plt.switch_backend('Agg')
+    note = str(sys.argv).replace("', '", " ").replace("['", "").replace("']", "")
     if viz == "heatmaps":
-        plot(["X","Y","Z"], data, None, True, str(sys.argv).replace("', '", " ").replace("['", "").replace("']", ""))
+        plot(titles, data, args.png, not args.headless, note, resolution=args.resolution)
+    else:
+        scatter(titles, data, args.png, not args.headless, note)
+
+# Saves simulation results, format is chosen by file extension:
+#   .npy - single (N, 3) array, or (panels, N, 3) array if there are several
+#   .npz - one (N, 3) array per panel, named by panel title
+#   .csv - x,y,value text, one file per panel (suffixed by panel title if there are several)
+def save(file_name, titles, data):
+    if file_name.endswith(".npy"):
+        np.save(file_name, data[0] if len(data) == 1 else np.array(data))
+    elif file_name.endswith(".npz"):
+        np.savez(file_name, **dict(zip(titles, data)))
     else:
-        scatter(["COORDS"], data, None, True, str(sys.argv).replace("', '", " ").replace("['", "").replace("']", ""))
+        for title, values in zip(titles, data):
+            name = file_name if len(data) == 1 else file_name.replace(".csv", "") + "_" + title + ".csv"
+            np.savetxt(name, values, fmt="%.3f", delimiter=",")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import sys
+import math
+import argparse
+import configparser
+
+import numpy as np
+
+from common import add_printer_arguments, printer_from_args
+
+# plot.py (matplotlib, scipy) is imported only when plotting
+
+# Carriage speed amplification: near the towers and at the bed edge the arms lean over and a carriage
+# has to move several times faster than the nozzle. For every bed position and travel direction the ratio
+# of carriage speed to nozzle speed is the derivative of move() carriage heights (DeltaPrinter.carriage_speeds()),
+# the fastest of the three carriages counts. Opposite directions have the same ratio, so directions cover 180 deg.
+#
+# Safe nozzle feedrate keeps every carriage within max_z_velocity (a Z move runs carriages at nozzle speed,
+# so that is the carriage speed the config trusts) and the nozzle within max_velocity; max_accel is scaled
+# by the same ratio to first order. Limits default to klipper/ramps.cfg, -k reads them (and geometry) from
+# another Klipper config.
+#
+# Usable radius is the largest circle around the center where every direction reaches the target feedrate,
+# given directly or as volumetric throughput (mm^3/s) with layer height and line width.
+#
+# Examples:
+#   ./speed.py
+#   ./speed.py -k ../klipper/ramps.cfg -F 120 -hl -png speed.png
+#   ./speed.py -T 8 -lh 0.2 -lw 0.4 -np > speed.csv
+
+# Returns (D,2) unit vectors of count directions over half a circle
+def directions(count):
+    angles = np.arange(count) * math.pi / count
+    return np.column_stack((np.cos(angles), np.sin(angles)))
+
+# Returns (N,D) ratios of fastest carriage speed to nozzle speed, NaN out of reach, in chunks to bound memory
+def amplification(printer, points, directions, chunk = 1 << 15):
+    ratios = np.empty((len(points), len(directions)))
+    for start in range(0, len(points), chunk):
+        speeds = np.abs(printer.carriage_speeds(points[start:start+chunk], directions))
+        ratios[start:start+chunk] = speeds.max(axis=2)
+    return ratios
+
+def feedrates(ratios, max_velocity, max_z_velocity):
+    with np.errstate(divide='ignore'):
+        return np.minimum(max_velocity, max_z_velocity / ratios)
+
+# Largest radius where every point has (worst direction) feedrate at least target, points out of reach
+# do not have it, returns None if the whole grid does
+def usable_radius(points, feedrate, target):
+    slow = ~(feedrate >= target)
+    if not slow.any():
+        return None
+    return np.hypot(points[slow,0], points[slow,1]).min()
+
+# Reads limits and geometry from Klipper delta config into args, values given there override defaults
+def read_klipper(file_name, args):
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'), strict=False)
+    if not config.read(file_name):
+        raise Exception("Can not read " + file_name)
+    printer = config['printer']
+    args.max_velocity = printer.getfloat('max_velocity', args.max_velocity)
+    args.max_accel = printer.getfloat('max_accel', args.max_accel)
+    args.max_z_velocity = printer.getfloat('max_z_velocity', args.max_z_velocity)
+    args.r_value = printer.get('delta_radius', args.r_value)
+    steppers = [config['stepper_' + t] for t in 'abc' if config.has_section('stepper_' + t)]
+    if len(steppers) == 3:
+        if all('arm_length' in s for s in steppers):
+            args.l_value = ",".join(s['arm_length'] for s in steppers)
+        if all('angle' in s for s in steppers):
+            args.a_value = ",".join(s['angle'] for s in steppers)
+
+def main():
+    parser = argparse.ArgumentParser(description='Carriage speed amplification and feedrate limits')
+    add_printer_arguments(parser)
+    parser.add_argument('-k','--klipper',type=str,default=None,help='Klipper config to read limits and geometry from')
+    parser.add_argument('-v','--max-velocity',type=float,default=300.,help='Max nozzle velocity, in mm/s')
+    parser.add_argument('-A','--max-accel',type=float,default=3000.,help='Max nozzle acceleration, in mm/s^2')
+    parser.add_argument('-z','--max-z-velocity',type=float,default=150.,help='Max Z (carriage) velocity, in mm/s')
+    parser.add_argument('-R','--radius',type=float,default=55.,help='Map radius, in mm')
+    parser.add_argument('-g','--grid',type=int,default=500,help='Map grid size')
+    parser.add_argument('-d','--directions',type=int,default=16,help='Number of travel directions')
+    parser.add_argument('-F','--feedrate',type=float,default=100.,help='Target feedrate, in mm/s')
+    parser.add_argument('-T','--throughput',type=float,default=None,help='Target volumetric throughput, in mm^3/s, instead of feedrate')
+    parser.add_argument('-lh','--layer-height',type=float,default=0.2,help='Layer height for throughput, in mm')
+    parser.add_argument('-lw','--line-width',type=float,default=0.4,help='Line width for throughput, in mm')
+    parser.add_argument('-png','--png',type=str,default=None,help='Save plot to PNG file')
+    parser.add_argument('-hl','--headless',action='store_true',help='Do not show plot window')
+    parser.add_argument('-np','--no-plot',action='store_true',help='Do not plot, print x,y,ratio,feedrate CSV rows')
+    args = parser.parse_args()
+
+    if args.klipper:
+        read_klipper(args.klipper, args)
+
+    printer = printer_from_args(args)
+
+    xi = np.linspace(-args.radius, args.radius, args.grid)
+    x, y = np.meshgrid(xi, xi)
+    points = np.column_stack((x.ravel(), y.ravel()))
+    inside = np.hypot(points[:,0], points[:,1]) <= args.radius
+
+    ratios = amplification(printer, points, directions(args.directions))
+    ratios[~inside] = np.nan
+    worst = ratios.max(axis=1)
+    feedrate = feedrates(worst, args.max_velocity, args.max_z_velocity)
+    accel = np.minimum(args.max_accel, args.max_accel / worst)
+
+    target = args.feedrate if args.throughput is None else args.throughput / (args.layer_height * args.line_width)
+    radius = usable_radius(points[inside], feedrate[inside], target)
+
+    center = amplification(printer, np.zeros((1, 2)), directions(args.directions)).max()
+    print("Limits: velocity {0:g} mm/s, accel {1:g} mm/s^2, z velocity {2:g} mm/s".format(args.max_velocity, args.max_accel, args.max_z_velocity), file=sys.stderr)
+    print("Speed ratio: {0:.2f} at center, {1:.2f} max within {2:g} mm".format(center, np.nanmax(worst), args.radius), file=sys.stderr)
+    print("Feedrate: {0:.0f} mm/s min, accel {1:.0f} mm/s^2 min within {2:g} mm".format(np.nanmin(feedrate), np.nanmin(accel), args.radius), file=sys.stderr)
+    if radius is None:
+        print("Usable radius for {0:.0f} mm/s: whole {1:g} mm map".format(target, args.radius), file=sys.stderr)
+    else:
+        print("Usable radius for {0:.0f} mm/s: {1:.1f} mm".format(target, radius), file=sys.stderr)
+
+    if args.no_plot:
+        rows = np.column_stack((points, worst, feedrate))[inside]
+        np.savetxt(sys.stdout, rows, fmt="%.3f", delimiter=",")
+        return
+
+    from plot import plot_grids, plt
+    if args.headless:
+        plt.switch_backend('Agg')
+    note = str(sys.argv).replace("', '", " ").replace("['", "").replace("']", "")
+    shape = (args.grid, args.grid)
+    plot_grids(["Speed ratio", "Feedrate, mm/s", "Accel, mm/s^2"], [(xi, xi, worst.reshape(shape)), (xi, xi, feedrate.reshape(shape)), (xi, xi, accel.reshape(shape))], args.png, not args.headless, note)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import math
+import sqlite3
+import argparse
+
+# Append-only store of evaluated sweep cells, so interrupted sweeps can be resumed and refined or
+# extended grids reuse cells evaluated before. Cells of a sweep are tuples of parameter values
+# (e.g. (l, r)), a sweep is identified by a key made of everything else the values depend on
+# (tool, observations, thresholds), not by the grid, so any grid over the same problem shares cells.
+#
+# Examples:
+#   ./find_lr.py -o '122.49,63.16,99;121.36,62.7,99.5' -db sweeps.db
+#   ./find_lr.py -o '122.49,63.16,99;121.36,62.7,99.5' -db sweeps.db -b 10
+#   ./store.py sweeps.db
+
+def sweep_key(**params):
+    return json.dumps(params, sort_keys=True)
+
+# cell values are rounded, grids built by repeated float addition still hit the same cells
+def cell_id(cell):
+    return ",".join(repr(round(float(v), 6)) for v in cell)
+
+class SweepStore:
+
+    def __init__(self, file_name, key, connection = None):
+        self.file_name = file_name
+        self.key = key
+        if connection is None:
+            connection = sqlite3.connect(file_name)
+            connection.execute("CREATE TABLE IF NOT EXISTS cells (sweep TEXT, cell TEXT, value REAL, PRIMARY KEY (sweep, cell))")
+            connection.commit()
+        self.connection = connection
+
+    # store of related values (e.g. adaptive search costs) in the same file
+    def child(self, name):
+        return SweepStore(self.file_name, self.key + "/" + name, self.connection)
+
+    # Returns {cell: value} for cells already stored, NaN values are stored as NULL and come back as NaN
+    def lookup(self, cells):
+        known = {}
+        ids = {cell_id(cell): cell for cell in cells}
+        names = list(ids)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start+500]
+            rows = self.connection.execute("SELECT cell, value FROM cells WHERE sweep = ? AND cell IN ({0})".format(",".join("?"*len(chunk))), [self.key] + chunk)
+            for name, value in rows:
+                known[ids[name]] = math.nan if value is None else value
+        return known
+
+    # rows are (cell, value) pairs, committed at once
+    def add(self, rows):
+        self.connection.executemany("INSERT OR IGNORE INTO cells VALUES (?, ?, ?)", [(self.key, cell_id(cell), None if math.isnan(value) else value) for cell, value in rows])
+        self.connection.commit()
+
+    # best n cells as (cell, value) pairs, by absolute value
+    def best(self, n):
+        rows = self.connection.execute("SELECT cell, value FROM cells WHERE sweep = ? AND value IS NOT NULL ORDER BY abs(value) LIMIT ?", (self.key, n))
+        return [(tuple(float(v) for v in name.split(",")), value) for name, value in rows]
+
+    def close(self):
+        self.connection.close()
+
+def sweeps(file_name):
+    connection = sqlite3.connect(file_name)
+    rows = connection.execute("SELECT sweep, count(*), min(abs(value)) FROM cells GROUP BY sweep ORDER BY sweep").fetchall()
+    connection.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Stored sweep results')
+    parser.add_argument('store',type=str,help='Sweep store file')
+    parser.add_argument('-k','--key',type=str,default=None,help='Sweep key, lists stored sweeps if not given')
+    parser.add_argument('-b','--best',type=int,default=10,help='Number of best cells to print')
+    args = parser.parse_args()
+
+    if args.key is None:
+        for key, count, best in sweeps(args.store):
+            print("{0} cells, best {1} - {2}".format(count, best, key))
+        return
+
+    store = SweepStore(args.store, args.key)
+    for cell, value in store.best(args.best):
+        print("{0} - {1}".format(",".join(str(v) for v in cell), value))
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import signal
+import contextlib
+import itertools
+import math
+
+from instrument import tally
+
+# concurrent.futures is imported when workers are started, single process runs start faster
+
+# Shared L/R grid sweep for find_lr and find_correct.
+# Grid is split into rows (one L value each), rows are evaluated on a process pool
+# and results are streamed back in grid order.
+# Adaptive mode refines a coarse grid down to the target step, see adaptive() below.
+
+def f_range(start, end, step):
+    while start <= end:
+        yield start
+        start += step
+
+# batch(ls, rs) evaluates cells (ls[k], rs[k]) at once, when given it is used instead of evaluate()
+def evaluate_row(evaluate, l, r_values, batch = None):
+    if batch is not None:
+        return list(batch([l]*len(r_values), r_values)) if r_values else []
+    return [evaluate(l, r) for r in r_values]
+
+# Runs fn(*args) in a worker and returns (result, text it printed), the parent writes the text with output()
+# when it takes the result, so diagnostics of the tools come out in grid order as in a single process run
+def captured(fn, *args):
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        result = fn(*args)
+    return result, text.getvalue()
+
+def output(result):
+    value, text = result
+    if text:
+        sys.stdout.write(text)
+    return value
+
+def ignore_interrupt():
+    # Ctrl-C is handled by the parent process only
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Yields (l, matches) for every L row, where matches are (l, r, error) triplets with abs(error) < limit.
+# With a store (see store.py) cells found there are not evaluated again and evaluated rows are added to it.
+# Rows run on the given executor (e.g. a pool shared by daemon requests), or on a pool of `jobs` workers
+# started here; rows not started yet are cancelled when the generator is closed.
+def sweep(evaluate, l_values, r_values, limit, jobs = None, store = None, batch = None, executor = None):
+    l_values = list(l_values)
+    r_values = list(r_values)
+    jobs = jobs or os.cpu_count() or 1
+
+    def missing(l):
+        known = store.lookup([(l, r) for r in r_values]) if store is not None else {}
+        return known, [r for r in r_values if (l, r) not in known]
+
+    def finish(l, known, todo, values):
+        if store is not None and todo:
+            store.add(zip([(l, r) for r in todo], values))
+        known.update(zip([(l, r) for r in todo], values))
+        matches = [(l, r, known[(l, r)]) for r in r_values if abs(known[(l, r)]) < limit]
+        tally('cells', len(r_values))
+        tally('evaluated', len(todo))
+        tally('matches', len(matches))
+        return l, matches
+
+    if jobs == 1 and executor is None:
+        for l in l_values:
+            known, todo = missing(l)
+            yield finish(l, known, todo, evaluate_row(evaluate, l, todo, batch))
+        return
+
+    own = executor is None
+    if own:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=ignore_interrupt)
+    rows = []
+    try:
+        for l in l_values:
+            known, todo = missing(l)
+            rows.append((l, known, todo, executor.submit(captured, evaluate_row, evaluate, l, todo, batch)))
+        while rows:
+            l, known, todo, future = rows.pop(0)
+            yield finish(l, known, todo, output(future.result()))
+    except KeyboardInterrupt:
+        # do not wait for rows already running in the workers
+        if own:
+            terminate(executor)
+        # but keep rows that are done
+        if store is not None:
+            for l, known, todo, future in rows:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    store.add(zip([(l, r) for r in todo], future.result()[0]))
+        raise
+    finally:
+        if own:
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for l, known, todo, future in rows:
+                future.cancel()
+
+def terminate(executor):
+    for process in list(executor._processes.values()):
+        process.terminate()
+
+# Coarse-to-fine search, cost(l, r) is a continuous version of evaluate() that is <= 1 for every accepted cell.
+# Grid is sampled every `coarse` cells first, cells that can not get below 1 (given estimated Lipschitz constant
+# of the cost times `safety`) are dropped, the rest are refined by halving the stride down to the target step.
+# Cells of the final grid left after refinement are evaluated with evaluate() (or batch()) exactly as sweep() would do.
+# Returns (matches, stats), matches are (l, r, error) triplets in grid order.
+# With a store, evaluate() results are stored like in sweep() and costs next to them, in chunks as they come.
+def adaptive(evaluate, cost, l_values, r_values, limit, coarse = 16, safety = 2.0, jobs = None, store = None, batch = None):
+    l_values = list(l_values)
+    r_values = list(r_values)
+    nl = len(l_values)
+    nr = len(r_values)
+    jobs = jobs or os.cpu_count() or 1
+    executor = None
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=ignore_interrupt)
+
+    def compute(fn, cells, many = None):
+        ls = [l_values[i] for i, j in cells]
+        rs = [r_values[j] for i, j in cells]
+        if many is not None:
+            if executor is None:
+                return list(many(ls, rs)) if cells else []
+            size = max(1, -(-len(cells) // jobs))
+            parts = executor.map(captured, itertools.repeat(many), [ls[k:k+size] for k in range(0, len(cells), size)], [rs[k:k+size] for k in range(0, len(cells), size)])
+            return [e for part in parts for e in output(part)]
+        if executor is None:
+            return list(map(fn, ls, rs))
+        return [output(e) for e in executor.map(captured, itertools.repeat(fn), ls, rs, chunksize=max(1, len(cells) // (jobs*4)))]
+
+    def run(fn, cells, store, many = None):
+        if store is None:
+            return compute(fn, cells, many)
+        known = store.lookup([(l_values[i], r_values[j]) for i, j in cells])
+        todo = [(i, j) for i, j in cells if (l_values[i], r_values[j]) not in known]
+        for start in range(0, len(todo), jobs*256):
+            chunk = todo[start:start+jobs*256]
+            values = compute(fn, chunk, many)
+            store.add(zip([(l_values[i], r_values[j]) for i, j in chunk], values))
+            known.update(zip([(l_values[i], r_values[j]) for i, j in chunk], values))
+        return [known[(l_values[i], r_values[j])] for i, j in cells]
+
+    stride = 1
+    while stride*2 <= coarse:
+        stride *= 2
+
+    # cells are kept on the stride lattice, cells past the last row/column are evaluated at the edge
+    def clamp(cell):
+        return min(cell[0], nl-1), min(cell[1], nr-1)
+
+    costs = {}
+    stats = {'cost': 0, 'evaluate': 0, 'grid': nl*nr}
+    try:
+        cells = set(itertools.product(range(0, nl + stride - 1, stride), range(0, nr + stride - 1, stride)))
+        lipschitz = None
+        while stride > 1:
+            todo = sorted(set(clamp(c) for c in cells if clamp(c) not in costs))
+            costs.update(zip(todo, run(cost, todo, store.child('cost') if store is not None else None)))
+            stats['cost'] += len(todo)
+
+            if lipschitz is None:
+                # estimate from neighbouring coarse samples, in cost per grid cell
+                lipschitz = 0.
+                for i, j in cells:
+                    for neighbour in [(i+stride, j), (i, j+stride)]:
+                        a, b = clamp((i, j)), clamp(neighbour)
+                        distance = max(b[0]-a[0], b[1]-a[1])
+                        if neighbour in cells and distance > 0 and not math.isnan(costs[a] - costs[b]):
+                            lipschitz = max(lipschitz, abs(costs[b] - costs[a]) / distance)
+                lipschitz *= safety
+
+            # NaN costs are kept, nothing is known about them
+            kept = [c for c in cells if not costs[clamp(c)] - lipschitz*stride > 1]
+            half = stride // 2
+            cells = set()
+            for i, j in kept:
+                for di, dj in itertools.product([-half, 0, half], repeat=2):
+                    if i+di >= 0 and j+dj >= 0:
+                        cells.add((i+di, j+dj))
+            stride = half
+
+        cells = sorted(set((i, j) for i, j in cells if i < nl and j < nr))
+        errors = run(evaluate, cells, store, batch)
+        stats['evaluate'] += len(cells)
+    except KeyboardInterrupt:
+        if executor is not None:
+            terminate(executor)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    matches = [(l_values[i], r_values[j], e) for (i, j), e in zip(cells, errors) if abs(e) < limit]
+    tally('cells', stats['grid'])
+    tally('cost evaluations', stats['cost'])
+    tally('evaluated', stats['evaluate'])
+    tally('matches', len(matches))
+    return matches, stats
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# tools are flat scripts in the simulator directory, tests import them as modules from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
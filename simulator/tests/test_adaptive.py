@@ -0,0 +1,48 @@
+import functools
+import math
+
+import numpy as np
+import pytest
+
+from sweep import sweep, adaptive, f_range
+import find_lr
+import find_correct
+
+observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+
+@pytest.mark.parametrize('flatness', [True, False])
+def test_adaptive_matches_full_sweep(flatness):
+    params = dict(observations=observations, error_treshold=0.1, filter_for_flattness=flatness)
+    # part of the find_lr grid around the matches
+    l_values = list(f_range(118.0, 126.0, 0.1))
+    r_values = list(f_range(60.0, 66.0, 0.1))
+    evaluate = functools.partial(find_lr.try_for, **params)
+    batch = functools.partial(find_lr.try_for_many, **params)
+    cost = functools.partial(find_lr.cost_for, **params)
+    full = [m for l, matches in sweep(evaluate, l_values, r_values, find_lr.match_limit, jobs=1, batch=batch) for m in matches]
+    found, stats = adaptive(evaluate, cost, l_values, r_values, find_lr.match_limit, coarse=8, jobs=1, batch=batch)
+    assert full
+    assert sorted(found) == sorted(full)
+    assert stats['evaluate'] < stats['grid']
+
+# matches along the edge of an unreachable (NaN cost) region, cells on the coarse grid next to them are NaN
+def edge_cost(l, r):
+    if l > 0.5:
+        return math.nan
+    return abs(l - 0.45) * 40 + abs(r - 0.3) * 10
+
+def edge_evaluate(l, r):
+    cost = edge_cost(l, r)
+    return 100 if not cost <= 1 else cost - 2
+
+def test_adaptive_keeps_unreachable_cells():
+    values = list(f_range(0., 1., 0.01))
+    full = [m for l, matches in sweep(edge_evaluate, values, values, 100, jobs=1) for m in matches]
+    found, stats = adaptive(edge_evaluate, edge_cost, values, values, 100, coarse=16, jobs=1)
+    assert full
+    assert sorted(found) == sorted(full)
+
+# cost of a cell with unreachable points is unknown, not low
+@pytest.mark.parametrize('tool, params', [(find_lr, dict(error_treshold=0.1)), (find_correct, dict(error_treshold=0.2))])
+def test_unreachable_cost_is_nan(tool, params):
+    assert np.isnan(tool.cost_for(60., 60., observations, **params))
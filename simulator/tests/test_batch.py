@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from delta_printer import DeltaPrinter, errors, errors_many
+from delta_printer_lean import DeltaPrinterLean
+import find_lr
+import find_correct
+
+points = np.array([[0., 0.], [0., 50.], [0., -50.], [30., 20.], [-40., 10.], [25., -35.], [-20., -40.]])
+
+observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+
+def candidates(count = 7):
+    rng = np.random.default_rng(1)
+    lengths = 120.8 + rng.normal(0, 1, (count, 3))
+    radii = 61.7 + rng.normal(0, 1, (count, 3))
+    angles = np.array([210., 330., 90.]) + rng.normal(0, 0.5, (count, 3))
+    endstops = rng.normal(0, 0.3, (count, 3))
+    return lengths, radii, angles, endstops
+
+@pytest.mark.parametrize('logical', [
+    DeltaPrinter(120.8, 61.7, 0.01, [210., 330., 90.], [0.1, -0.05, 0.]),
+    DeltaPrinterLean(120.8, 61.7, 0.01, [210., 330., 90.], [0., 0.2, 0.], [89.5, 90., 90.3]),
+])
+def test_errors_many_matches_errors(logical):
+    logical.home()
+    lengths, radii, angles, endstops = candidates()
+    # chunk of 2 candidates exercises chunking and the shorter last chunk
+    nps, valid = errors_many(logical, points, lengths, radii, angles, endstops, chunk = 2*len(points))
+    for g in range(len(lengths)):
+        physical = DeltaPrinter(list(lengths[g]), list(radii[g]), logical.step_size, list(angles[g]), list(endstops[g]))
+        expected, expected_valid = errors(physical, logical, points)
+        assert (valid[g] == expected_valid).all()
+        assert np.allclose(nps[g], expected, atol=1e-9, equal_nan=True)
+
+# (G,1) columns and plain values broadcast to every tower and candidate
+def test_errors_many_broadcasts_columns():
+    logical = DeltaPrinter(120.8, 61.7)
+    logical.home()
+    ls = np.array([119.5, 120.8, 122.])
+    nps = errors_many(logical, points, ls[:,None], 61.2)[0]
+    for g, l in enumerate(ls):
+        assert np.allclose(nps[g], errors(DeltaPrinter(l, 61.2), logical, points)[0], atol=1e-9)
+
+def scalar(tool, l, r, **params):
+    try:
+        return tool.try_for(l, r, observations, **params)
+    except Exception:
+        # unreachable points, rejected by try_for_many()
+        return 100
+
+def cells():
+    ls, rs = np.meshgrid(np.arange(120.5, 123.0, 0.25), np.arange(62.0, 64.0, 0.25))
+    return ls.ravel(), rs.ravel()
+
+@pytest.mark.parametrize('flatness', [True, False])
+def test_find_lr_batch_matches_scalar(flatness):
+    ls, rs = cells()
+    batch = find_lr.try_for_many(ls, rs, observations, 0.1, flatness)
+    expected = [scalar(find_lr, l, r, error_treshold=0.1, filter_for_flattness=flatness) for l, r in zip(ls, rs)]
+    assert np.allclose(batch, expected, atol=1e-9)
+    assert any(v != 100 for v in batch)
+
+def test_find_correct_batch_matches_scalar(capsys):
+    ls, rs = cells()
+    batch = find_correct.try_for_many(ls, rs, observations, 0.2)
+    printed = capsys.readouterr().out
+    expected = [scalar(find_correct, l, r, error_treshold=0.2) for l, r in zip(ls, rs)]
+    assert np.allclose(batch, expected, atol=1e-9)
+    assert printed == capsys.readouterr().out
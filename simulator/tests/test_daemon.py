@@ -0,0 +1,35 @@
+import numpy as np
+
+import daemon
+import find_correct
+
+observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+
+def finished_job(jobs, id, finished):
+    jobs.jobs[id] = {'id': id, 'state': 'done', 'rows': 1, 'total': 1, 'matches': [[1, 2, 3]], 'cancel': False, 'started': 0., 'finished': finished}
+
+def test_finished_job_is_dropped_when_read():
+    jobs = daemon.Jobs()
+    finished_job(jobs, 1, 1.)
+    jobs.jobs[2] = {'id': 2, 'state': 'running', 'rows': 0, 'total': 1, 'matches': [], 'cancel': False, 'started': 0.}
+    assert jobs.progress({'job': 2})['state'] == 'running'
+    assert jobs.progress({'job': 1})['matches'] == [[1, 2, 3]]
+    assert list(jobs.jobs) == [2]
+
+def test_oldest_finished_jobs_are_pruned():
+    jobs = daemon.Jobs(kept = 2)
+    for id in range(1, 5):
+        finished_job(jobs, id, float(id))
+    jobs.jobs[5] = {'id': 5, 'state': 'running', 'rows': 0, 'total': 1, 'matches': [], 'cancel': False, 'started': 0.}
+    jobs.prune()
+    assert sorted(jobs.jobs) == [3, 4, 5]
+
+def test_find_correct_quiet(capsys):
+    ls, rs = np.meshgrid(np.arange(120.5, 123.0, 0.25), np.arange(62.0, 64.0, 0.25))
+    find_correct.try_for_many(ls.ravel(), rs.ravel(), observations, 0.2, verbose=False)
+    for l, r in zip(ls.ravel(), rs.ravel()):
+        try:
+            find_correct.try_for(l, r, observations, 0.2, verbose=False)
+        except Exception:
+            pass
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,68 @@
+import pytest
+import numpy as np
+
+from delta_printer import DeltaPrinter, DeltaGeometry, MoveCache, error, errors
+
+points = np.array([[0., 0.], [0., 50.], [0., -50.], [30., 20.], [-40., 10.], [25., -35.]])
+
+def printers():
+    physical = DeltaPrinter([120.4, 121.1, 119.8], [61.2, 62.3, 61.9], 0.01, [209.5, 330.4, 90.2])
+    logical = DeltaPrinter(120.8, 61.7, 0.01, [210., 330., 90.], [0.1, -0.05, 0.])
+    logical.home()
+    return physical, logical
+
+def test_geometry_values_are_read_only():
+    printer = DeltaPrinter([120.4, 121.1, 119.8], 61.7, 0.01)
+    for name in ['l', 'r', 'endstops', 'step_size', 'tower_angles', 'tower_coords']:
+        with pytest.raises(AttributeError):
+            setattr(printer, name, getattr(printer, name))
+    with pytest.raises(TypeError):
+        printer.l[0] = 121.
+    assert printer.l == printer.geometry.lengths
+    assert printer.tower_coords == printer.geometry.tower_xy
+
+def test_cache_follows_geometry():
+    cache = MoveCache()
+    a = DeltaPrinter(120.8, 61.7)
+    b = DeltaPrinter(121.8, 61.7)
+    a.cache = b.cache = cache
+    a.home()
+    b.home()
+    a.move(10, 20)
+    b.move(10, 20)
+    assert a.tower_steps != b.tower_steps
+    assert a.geometry == DeltaPrinter.from_geometry(a.geometry).geometry
+
+# least recently used points are dropped beyond maxsize, cached steps are the computed ones
+def test_cache_evicts_least_recently_used():
+    cache = MoveCache(maxsize = 4)
+    printer = DeltaPrinter(120.8, 61.7)
+    printer.cache = cache
+    printer.home()
+    cache.clear()
+    for x in range(5):
+        printer.move(x, 0)
+    assert (cache.hits, cache.misses, len(cache.entries)) == (0, 5, 4)
+    printer.move(1, 0)
+    printer.move(0, 0)
+    assert (cache.hits, cache.misses) == (1, 6)
+    # (2, 0) was least recently used after (1, 0) was hit
+    assert [key[1] for key in cache.entries] == [3, 4, 1, 0]
+    expected = DeltaPrinter(120.8, 61.7)
+    expected.home()
+    expected.move(1, 0)
+    printer.move(1, 0)
+    assert printer.tower_steps == expected.tower_steps
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache.entries)) == (0, 0, 0)
+
+# move_many()/nozzle_positions() against move()/nozzle_position() point by point
+def test_batch_matches_scalar():
+    physical, logical = printers()
+    steps = logical.move_many(points)
+    nps, valid = errors(physical, logical, points)
+    assert valid.all()
+    for (x, y), row, expected in zip(points, steps, nps):
+        logical.move(x, y)
+        assert list(row) == logical.tower_steps
+        assert np.allclose(error(physical, logical, x, y), expected, atol=1e-9)
@@ -0,0 +1,23 @@
+import functools
+
+import pytest
+
+import instrument
+import find_lr
+from sweep import sweep, f_range
+
+observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+
+# every evaluated cell is either a match or a rejected candidate, whether evaluated one by one or batched
+@pytest.mark.parametrize('batched', [False, True])
+def test_rejected_candidates_are_counted(batched):
+    params = dict(observations=observations, error_treshold=0.1)
+    evaluate = functools.partial(find_lr.try_for, **params)
+    batch = functools.partial(find_lr.try_for_many, **params) if batched else None
+    instrument.counts.clear()
+    for l, matches in sweep(evaluate, f_range(120., 124., 0.1), f_range(61., 65., 0.1), find_lr.match_limit, jobs=1, batch=batch):
+        pass
+    counts = instrument.counts
+    assert counts['matches'] > 0
+    assert counts['rejected'] > 0
+    assert counts['matches'] + counts['rejected'] == counts['evaluated'] == counts['cells']
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from delta_printer import DeltaPrinter, errors, jacobian, jacobian_params
+
+points = np.array([[0., 0.], [0., 50.], [0., -50.], [30., 20.], [-40., 10.], [25., -35.], [-20., -40.]])
+
+# step size small enough for step rounding to stay far below the finite difference resolution
+step_size = 1e-9
+
+def geometry(printer):
+    g = printer.geometry
+    return [list(g.lengths), list(g.radii), list(g.angles), list(g.endstops)]
+
+# printer with parameter k (in jacobian_params order) changed by h
+def perturbed(printer, k, h, home = False):
+    values = geometry(printer)
+    values[k // 3][k % 3] += h
+    lengths, radii, angles, endstops = values
+    printer = DeltaPrinter(lengths, radii, step_size, angles, endstops)
+    if home:
+        printer.home()
+    return printer
+
+def printers():
+    physical = DeltaPrinter([120.4, 121.1, 119.8], [61.2, 62.3, 61.9], step_size, [209.5, 330.4, 90.2], [0.3, -0.2, 0.1])
+    logical = DeltaPrinter([120.8, 120.9, 120.7], [61.7, 61.6, 61.8], step_size, [210., 330., 90.], [0.1, -0.05, 0.])
+    logical.home()
+    return physical, logical
+
+@pytest.mark.parametrize('wrt', ['physical', 'logical'])
+def test_jacobian_matches_central_differences(wrt):
+    physical, logical = printers()
+    J, valid = jacobian(physical, logical, points, wrt)
+    assert valid.all()
+    h = 1e-4
+    for k, name in enumerate(jacobian_params):
+        if wrt == 'physical':
+            plus = errors(perturbed(physical, k, h), logical, points)[0]
+            minus = errors(perturbed(physical, k, -h), logical, points)[0]
+        else:
+            plus = errors(physical, perturbed(logical, k, h, True), points)[0]
+            minus = errors(physical, perturbed(logical, k, -h, True), points)[0]
+        assert np.allclose(J[:,:,k], (plus - minus) / (2*h), atol=1e-5), name
+
+# equal physical and logical endstops cancel out, driving a printer by its own geometry has no error
+def test_same_geometry_has_no_error():
+    physical, logical = printers()
+    nps, valid = errors(DeltaPrinter.from_geometry(logical.geometry), logical, points)
+    assert valid.all()
+    assert np.allclose(nps[:,0:2], points, atol=1e-6)
+    assert np.allclose(nps[:,2], 0, atol=1e-6)
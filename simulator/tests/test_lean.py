@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from delta_printer import jacobian
+from delta_printer_lean import DeltaPrinterLean
+from common import get_points_wheel
+
+def new_printer(step_size = 0.01):
+    printer = DeltaPrinterLean([120.4, 121.1, 119.8], [61.2, 62.3, 61.9], step_size, [209.5, 330.4, 90.2], [0.1, -0.05, 0.], [89.2, 90.5, 89.8])
+    printer.home()
+    return printer
+
+wheel = get_points_wheel(45, 5, 15.)
+points = np.column_stack((wheel, np.arange(len(wheel)) % 3 * 5.))
+
+def test_move_many_matches_move():
+    printer = new_printer()
+    steps = printer.move_many(points)
+    for point, expected in zip(points, steps):
+        printer.move(*point)
+        assert printer.tower_steps == list(expected)
+
+# inverse then forward kinematics returns the point up to step rounding (half a step on each carriage
+# adds up to a bit more than a step in XY near the towers, so the step is finer than rounding needs)
+@pytest.mark.parametrize('step_size', [0.001, 0.0001])
+def test_nozzle_position_round_trip(step_size):
+    printer = new_printer(step_size)
+    nps, valid = printer.nozzle_positions(printer.move_many(points))
+    assert valid.all()
+    assert np.abs(nps - points).max() < printer.step_size
+    for point in points[::7]:
+        printer.move(*point)
+        assert np.abs(np.array(printer.nozzle_position()) - point).max() < printer.step_size
+
+def test_jacobian_rejects_leaning_towers():
+    vertical = DeltaPrinterLean(120.8, 61.7)
+    vertical.home()
+    with pytest.raises(TypeError):
+        jacobian(new_printer(), vertical, points[:,0:2])
+    with pytest.raises(TypeError):
+        jacobian(vertical, new_printer(), points[:,0:2], 'logical')
+    # leaning logical printer only drives the carriages
+    assert jacobian(vertical, new_printer(), points[:,0:2])[1].all()
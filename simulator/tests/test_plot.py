@@ -0,0 +1,49 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+pytest.importorskip('matplotlib')
+
+import plot
+from sim_warp import save
+
+def test_triangulation_cache_is_bounded():
+    plot.triangulations.clear()
+    rng = np.random.default_rng(1)
+    first = rng.random((2, 20))
+    kept = plot.triangulation(*first)
+    for i in range(plot.triangulations_kept * 2):
+        plot.triangulation(*rng.random((2, 20)))
+        # recently used set stays cached
+        assert plot.triangulation(*first) is kept
+    assert len(plot.triangulations) == plot.triangulations_kept
+
+@pytest.mark.parametrize('extension', ['.npy', '.npz', '.csv'])
+def test_saved_panels_plot(tmp_path, extension):
+    rng = np.random.default_rng(2)
+    xy = rng.random((50, 2)) * 100 - 50
+    titles = ["X", "Y", "Z"]
+    data = [np.column_stack((xy, rng.random(50))) for i in range(3)]
+    file_name = str(tmp_path / ("warp" + extension))
+    save(file_name, titles, data)
+    if extension == '.csv':
+        file_name = file_name.replace(".csv", "_Z.csv")
+    read_titles, panels = plot.read_panels(file_name)
+    if extension == '.npz':
+        assert read_titles == titles
+    if extension != '.csv':
+        assert len(panels) == 3
+        assert np.allclose(plot.load(panels[2])[2], data[2][:,2])
+    output_file = str(tmp_path / "warp.png")
+    plot.plot(read_titles, panels, output_file, False, resolution=50)
+    assert (tmp_path / "warp.png").stat().st_size > 0
+
+def test_sim_warp_output_plots(tmp_path):
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, os.path.join(here, "sim_warp.py"), "-l", "123.5", "-r", "63.7", "-wl", "120", "-wr", "62.7", "-v", "heatmaps", "-np", "-o", "w.npy"], cwd=tmp_path, check=True, capture_output=True)
+    subprocess.run([sys.executable, os.path.join(here, "plot.py"), "-hl", "-res", "50", "w.npy"], cwd=tmp_path, check=True, capture_output=True)
+    assert (tmp_path / "w.png").exists()
@@ -0,0 +1,50 @@
+import numpy as np
+
+from delta_printer import DeltaPrinter, errors
+from probe_data import ProbeFit, read_samples, read_chunks
+
+logical = DeltaPrinter(120.8, 61.7, 0.01)
+logical.home()
+
+# true printer: longer radius, endstops and tower A/B angles off
+physical = DeltaPrinter(120.8, 62.0, 0.01, [210.2, 329.85, 90.], [0.2, -0.1, 0.])
+
+def probed(points, offset):
+    return -errors(physical, logical, points)[0][:,2] + offset
+
+def probe_lines(points, offset):
+    return ["// probe at {0:.3f},{1:.3f} is z={2:.6f}".format(x, y, z) for (x, y), z in zip(points, probed(points, offset))]
+
+def mesh_lines(offset):
+    grid = np.arange(-30., 31., 15.)
+    x, y = np.meshgrid(grid, grid)
+    z = probed(np.column_stack((x.ravel(), y.ravel())), offset).reshape(x.shape)
+    # mesh heights are relative to the mesh
+    z -= z[2, 2]
+    return ["#*# [bed_mesh default]", "#*# version = 1", "#*# points ="] + \
+        ["#*# \t  " + ", ".join("{0:.6f}".format(v) for v in row) for row in z] + \
+        ["#*# x_count = 5", "#*# y_count = 5", "#*# min_x = -30.0", "#*# max_x = 30.0", "#*# min_y = -30.0", "#*# max_y = 30.0"]
+
+def log():
+    angles = np.radians(np.arange(0, 360, 30))
+    ring = np.column_stack((np.cos(angles), np.sin(angles)))
+    return ["Send: G28"] + probe_lines(np.vstack(([[0, 0]], 30*ring)), 1.5) + \
+        ["Recv: ok", "Send: G28"] + probe_lines(np.vstack(([[0, 0]], 15*ring)), 1.2) + mesh_lines(0.)
+
+def test_sources_are_numbered_per_run_and_mesh():
+    samples = list(read_samples(log()))
+    assert [s[3] for s in samples] == [0]*13 + [1]*13 + [2]*25
+
+def test_fit_recovers_deviations():
+    fit = ProbeFit(logical, ['e0', 'e1', 'e2', 'r', 'a0', 'a1'])
+    for chunk in read_chunks(log(), 16):
+        fit.add(chunk)
+    deviations, offsets, rms = fit.solve(1e-9)
+    assert fit.count == 51 and fit.sources == 3
+    assert rms < 0.002
+    endstops = np.array([deviations[p] for p in ['e0', 'e1', 'e2']])
+    # endstops only relative to each other, their common part is in the offsets
+    assert np.allclose(endstops - endstops.mean(), np.array([0.2, -0.1, 0.]) - 1/30., atol=0.01)
+    assert abs(deviations['r'] - 0.3) < 0.01
+    assert abs(deviations['a0'] - 0.2) < 0.02
+    assert abs(deviations['a1'] + 0.15) < 0.02
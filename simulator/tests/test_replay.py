@@ -0,0 +1,25 @@
+import pytest
+
+from delta_printer import DeltaPrinter
+from error_table import ErrorTable
+from replay import replay
+
+pytest.importorskip('scipy')
+
+correct = DeltaPrinter(123.5, 63.7)
+wrong = DeltaPrinter(120., 62.7)
+wrong.home()
+
+# (x, y, z, e) moves: 2 inside of the table, 1 beyond its radius but printable, 1 out of reach
+moves = [(0., 0., 0., 0.), (10., 5., 0., 0.), (45., 0., 0., 0.), (500., 0., 0., 0.)]
+
+def test_moves_outside_of_table_are_not_unreachable():
+    table = ErrorTable.build(correct, wrong, radius=30., grid=1.)
+    layers, unreachable, outside = replay(moves, correct, wrong, table=table)
+    assert (unreachable, outside) == (0, 2)
+    assert layers[0.][0] == 2
+
+def test_exact_replay_counts_unreachable():
+    layers, unreachable, outside = replay(moves, correct, wrong)
+    assert (unreachable, outside) == (1, 0)
+    assert layers[0.][0] == 3
@@ -0,0 +1,30 @@
+import functools
+
+import pytest
+
+from sweep import sweep, adaptive, f_range
+import find_correct
+
+observations = [x.split(",") for x in '122.49,63.16,99;121.36,62.7,99.5'.split(";")]
+evaluate = functools.partial(find_correct.try_for, observations=observations, error_treshold=0.2)
+batch = functools.partial(find_correct.try_for_many, observations=observations, error_treshold=0.2)
+cost = functools.partial(find_correct.cost_for, observations=observations, error_treshold=0.2)
+l_values = list(f_range(110., 118., 0.5))
+r_values = list(f_range(55., 62., 0.5))
+
+def run_sweep(jobs, batch):
+    for l, matches in sweep(evaluate, l_values, r_values, find_correct.match_limit, jobs, batch=batch):
+        print(l)
+
+def run_adaptive(jobs, batch):
+    adaptive(evaluate, cost, l_values, r_values, find_correct.match_limit, coarse=4, jobs=jobs, batch=batch)
+
+# rejection messages printed by try_for()/try_for_many() in workers come out in grid order
+@pytest.mark.parametrize('run', [run_sweep, run_adaptive])
+@pytest.mark.parametrize('many', [None, batch])
+def test_parallel_output_matches_single_process(capsys, run, many):
+    run(1, many)
+    single = capsys.readouterr().out
+    run(3, many)
+    assert single.count(", 0.000, ") >= 3
+    assert capsys.readouterr().out == single
@@ -0,0 +1,46 @@
+import numpy as np
+
+from delta_printer import DeltaPrinter, errors
+from common import get_points_wheel
+from tolerance import Aggregate, evaluate_chunk, sample_metrics, metrics
+
+nominal = DeltaPrinter(120.8, 61.7, 0.01).geometry
+points = get_points_wheel(45, 5, 15.)
+
+# a chunk where no sampled printer reaches all points still counts its samples as non-intersecting
+def test_chunk_without_intersecting_samples():
+    sigmas = [500.]*3 + [0.]*9
+    aggregate = evaluate_chunk(nominal, sigmas, 'normal', points, 10, np.random.SeedSequence(0))
+    assert aggregate.count == 0 and aggregate.failed == 10
+    total = Aggregate(3)
+    total.merge(aggregate)
+    assert total.failed == 10 and (total.maximum == 0).all()
+
+def test_chunks_merge_to_single_run():
+    sigmas = [0.1]*3 + [0.1]*3 + [0.1]*3 + [0.05]*3
+    seeds = np.random.SeedSequence(0).spawn(2)
+    total = Aggregate(12)
+    for seed in seeds:
+        total.merge(evaluate_chunk(nominal, sigmas, 'normal', points, 20, seed))
+    assert total.count + total.failed == 40
+    assert total.histograms.sum(axis=1).tolist() == [total.count]*len(metrics)
+
+# batched metrics are those of every sampled printer built with its geometry, endstops included
+def test_sample_metrics_match_printers():
+    logical = DeltaPrinter.from_geometry(nominal)
+    logical.home()
+    rng = np.random.default_rng(4)
+    base = np.array(nominal.lengths + nominal.radii + nominal.angles + nominal.endstops)
+    params = base + rng.standard_normal((6, 12)) * np.array([0.3]*6 + [0.2]*6)
+    # same endstop error on every tower only lowers the nozzle
+    params[0] = base + np.array([0.]*9 + [0.2]*3)
+    values, ok = sample_metrics(logical, points, params, nominal.step_size)
+    assert ok.all()
+    for p, value in zip(params, values):
+        physical = DeltaPrinter(list(p[0:3]), list(p[3:6]), nominal.step_size, list(p[6:9]), list(p[9:12]))
+        nps = errors(physical, logical, points)[0]
+        expected = [nps[:,2].max() - nps[:,2].min(), np.hypot(nps[:,0] - points[:,0], nps[:,1] - points[:,1]).max()]
+        assert np.allclose(value, expected, atol=1e-9)
+    nps = errors(DeltaPrinter.from_geometry(nominal), logical, points)[0]
+    shifted = errors(DeltaPrinter(list(nominal.lengths), list(nominal.radii), nominal.step_size, list(nominal.angles), list(params[0,9:12])), logical, points)[0]
+    assert np.allclose(shifted[:,2] - nps[:,2], -0.2)
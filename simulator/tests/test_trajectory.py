@@ -0,0 +1,56 @@
+import math
+
+import numpy as np
+
+from delta_printer import DeltaPrinter
+from trajectory import trajectory_events
+
+def new_printer():
+    printer = DeltaPrinter([120.4, 121.1, 119.8], [61.2, 62.3, 61.9], 0.01, [209.5, 330.4, 90.2], [0.1, -0.05, 0.])
+    printer.home()
+    return printer
+
+# at the middle between consecutive events tower steps must be what move() gives for that point
+def test_events_match_move():
+    rng = np.random.default_rng(3)
+    angles = rng.random(12) * 2*math.pi
+    radii = np.sqrt(rng.random(12)) * 50
+    moves = [(r*math.cos(a), r*math.sin(a), z, 50.) for a, r, z in zip(angles, radii, rng.random(12) * 5)]
+    moves.append((0., 0., 0., 50.))
+
+    printer = new_printer()
+    reference = new_printer()
+    times, steps = [0.], [None]
+    count = 0
+    for t, tower, direction in trajectory_events(printer, moves):
+        times.append(t)
+        steps.append(list(printer.tower_steps))
+        count += 1
+    assert count > 1000
+
+    # position along the move sequence at time t
+    starts, t = [], 0.
+    position = (0., 0., 0.)
+    for x, y, z, feedrate in moves:
+        length = math.dist(position, (x, y, z))
+        starts.append((t, position, (x, y, z)))
+        t += length / feedrate
+        position = (x, y, z)
+    def at(t):
+        for t0, p0, p1 in reversed(starts):
+            if t >= t0:
+                duration = math.dist(p0, p1) / 50.
+                u = min((t - t0) / duration, 1.) if duration > 0 else 1.
+                return [a + u*(b - a) for a, b in zip(p0, p1)]
+
+    checked = 0
+    for i in range(1, len(times) - 1):
+        # skip simultaneous events (other tower stepping at the same time)
+        if times[i+1] - times[i] < 1e-9:
+            continue
+        reference.move(*at((times[i] + times[i+1]) / 2))
+        assert reference.tower_steps == steps[i]
+        checked += 1
+    assert checked > count // 2
+    reference.move(0., 0., 0.)
+    assert printer.tower_steps == reference.tower_steps
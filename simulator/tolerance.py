@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from delta_printer import DeltaPrinter, errors_chunks, jacobian_params
+from common import get_points_wheel, add_printer_arguments, printer_from_args
+from sweep import ignore_interrupt
+
+# Monte Carlo tolerance analysis: physical printers are drawn around the nominal (firmware) geometry,
+# each is evaluated over the sim_warp heatmap wheel and only aggregates are kept:
+#   flatness  - max-min nozzle height over the wheel
+#   xy error  - max XY deviation of the nozzle from commanded position
+# Percentiles come from fixed-bin histograms, parameter contributions from a running linear regression
+# of each metric on absolute parameter deviations (in sigmas).
+#
+# Examples:
+#   ./tolerance.py -n 100000 -sl 0.1 -sr 0.1 -sa 0.1 -se 0.05
+#   ./tolerance.py -n 20000 -sl 0.2 -d uniform -j 4
+
+metrics = ['flatness', 'xy']
+bins = 20000
+hist_max = 10. # mm, larger values go to the last bin
+
+class Aggregate:
+
+    def __init__(self, params):
+        self.count = 0
+        self.failed = 0
+        self.histograms = np.zeros((len(metrics), bins + 1), dtype=np.int64)
+        self.maximum = np.zeros(len(metrics))
+        size = params + 1
+        self.xtx = np.zeros((size, size))
+        self.xty = np.zeros((size, len(metrics)))
+
+    def add(self, deviations, values):
+        # deviations (N, params) in sigmas, values (N, metrics)
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        index = np.minimum((values / hist_max * bins).astype(int), bins)
+        for m in range(len(metrics)):
+            self.histograms[m] += np.bincount(index[:,m], minlength=bins + 1)
+        self.maximum = np.maximum(self.maximum, values.max(axis=0))
+        x = np.hstack((np.abs(deviations), np.ones((len(values), 1))))
+        self.xtx += x.T @ x
+        self.xty += x.T @ values
+
+    def merge(self, other):
+        self.count += other.count
+        self.failed += other.failed
+        self.histograms += other.histograms
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.xtx += other.xtx
+        self.xty += other.xty
+
+    def percentile(self, metric, q):
+        cumulative = np.cumsum(self.histograms[metric])
+        index = np.searchsorted(cumulative, q/100 * cumulative[-1])
+        return min((index + 1) * hist_max / bins, self.maximum[metric])
+
+    # mm of metric per sigma of absolute deviation, per parameter
+    def contributions(self):
+        coefficients = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        return coefficients[:-1]
+
+# Returns (N, metrics) values and (N,) mask of printers reaching every point, for N sampled printers given
+# as (N,12) params in jacobian_params order, driven by the logical printer. Printers are evaluated in geometry
+# batches (errors_chunks()), endstops shift carriages on the rails as in carriage_coords().
+def sample_metrics(logical, points, params, step_size):
+    values = np.empty((len(params), len(metrics)))
+    ok = np.ones(len(params), dtype=bool)
+    for start, nps, intersect in errors_chunks(logical, points, params[:,0:3], params[:,3:6], params[:,6:9], params[:,9:12], step_size):
+        end = start + len(nps)
+        ok[start:end] = intersect.all(axis=1)
+        values[start:end, 0] = nps[:,:,2].max(axis=1) - nps[:,:,2].min(axis=1)
+        values[start:end, 1] = np.hypot(nps[:,:,0] - points[:,0], nps[:,:,1] - points[:,1]).max(axis=1)
+    return values, ok
+
+def evaluate_chunk(nominal, sigmas, distribution, points, count, seed):
+    rng = np.random.default_rng(seed)
+    logical = DeltaPrinter.from_geometry(nominal)
+    logical.home()
+
+    varied = [i for i, s in enumerate(sigmas) if s > 0]
+    aggregate = Aggregate(len(varied))
+    base = np.array(nominal.lengths + nominal.radii + nominal.angles + nominal.endstops)
+    if distribution == 'uniform':
+        draws = rng.uniform(-1, 1, (count, len(sigmas)))
+    else:
+        draws = rng.standard_normal((count, len(sigmas)))
+    draws[:, [i for i, s in enumerate(sigmas) if s == 0]] = 0
+    params = base + draws * np.array(sigmas)
+
+    values, ok = sample_metrics(logical, points, params, nominal.step_size)
+    aggregate.add(draws[ok][:, varied], values[ok])
+    aggregate.failed = int((~ok).sum())
+    return aggregate
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo tolerance analysis')
+    add_printer_arguments(parser, 'Nominal')
+    parser.add_argument('-sl','--sigma-l',type=float,default=0.1,help='Rod length tolerance, in mm')
+    parser.add_argument('-sr','--sigma-r',type=float,default=0.1,help='Radius tolerance, in mm')
+    parser.add_argument('-sa','--sigma-a',type=float,default=0.1,help='Tower angle tolerance, in deg')
+    parser.add_argument('-se','--sigma-e',type=float,default=0.05,help='Endstop tolerance, in mm')
+    parser.add_argument('-d','--distribution',type=str,default='normal',choices=['normal', 'uniform'],help='Tolerances are sigmas (normal) or half-widths (uniform)')
+    parser.add_argument('-n','--samples',type=int,default=10000,help='Number of sampled printers')
+    parser.add_argument('-c','--chunk',type=int,default=2000,help='Samples per worker task')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='Number of worker processes, defaults to number of cores')
+    parser.add_argument('--seed',type=int,default=0,help='Random seed')
+    args = parser.parse_args()
+
+    nominal = printer_from_args(args).geometry
+    sigmas = [args.sigma_l]*3 + [args.sigma_r]*3 + [args.sigma_a]*3 + [args.sigma_e]*3
+    names = [name for name, s in zip(jacobian_params, sigmas) if s > 0]
+    points = get_points_wheel(45, 5, 15.)
+
+    # chunk seeds do not depend on number of workers, results are reproducible
+    counts = [min(args.chunk, args.samples - start) for start in range(0, args.samples, args.chunk)]
+    seeds = np.random.SeedSequence(args.seed).spawn(len(counts))
+    total = Aggregate(len(names))
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for count, seed in zip(counts, seeds):
+            total.merge(evaluate_chunk(nominal, sigmas, args.distribution, points, count, seed))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=ignore_interrupt) as executor:
+            futures = [executor.submit(evaluate_chunk, nominal, sigmas, args.distribution, points, count, seed) for count, seed in zip(counts, seeds)]
+            for future in futures:
+                total.merge(future.result())
+
+    print("Samples: {0}, non-intersecting: {1}".format(total.count, total.failed))
+    print("{0:>10} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}".format("metric, mm", "p50", "p90", "p95", "p99", "max"))
+    for m, metric in enumerate(metrics):
+        print("{0:>10} {1:>8.4f} {2:>8.4f} {3:>8.4f} {4:>8.4f} {5:>8.4f}".format(metric, *[total.percentile(m, q) for q in [50, 90, 95, 99]], total.maximum[m]))
+
+    contributions = total.contributions()
+    for m, metric in enumerate(metrics):
+        ranking = sorted(zip(names, contributions[:,m]), key=lambda c: -c[1])
+        print("Top contributors to {0} (mm per sigma): {1}".format(metric, ", ".join("{0} {1:.4f}".format(n, c) for n, c in ranking[:5])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import sys
+import math
+import heapq
+import argparse
+
+from delta_printer import DeltaPrinter
+from gcode import read_moves
+
+# Step-exact replay of straight moves on a delta printer with vertical towers.
+#
+# Along a segment P(u) = P0 + u*D, u in [0, 1], carriage height of a tower at (tx, ty) is
+#   h(u) = z0 + u*dz + sqrt(L^2 - |q0 + u*d|^2),  q0 = (x0-tx, y0-ty), d = (dx, dy)
+# h is concave, so it rises and falls at most once. Tower steps are round(h/step), a step happens
+# where h crosses (n+0.5)*step, which is a quadratic equation in u. Every step event is found directly,
+# without evaluating inverse kinematics at sub-points, and only the current boundary is kept in memory.
+#
+# Examples:
+#   ./trajectory.py print.gcode -l 120.8 -r 61.7
+#   ./trajectory.py -m '0,0,1,150;30,0,1,150' -v
+
+# Returns roots of a*u^2 + b*u + c = 0 (numerically stable form)
+def quadratic_roots(a, b, c):
+    if a == 0:
+        return [-c/b] if b != 0 else []
+    disc = b*b - 4*a*c
+    if disc < 0:
+        if disc < -1e-9*(b*b + abs(4*a*c)):
+            return []
+        disc = 0.
+    q = -0.5*(b + math.copysign(math.sqrt(disc), b))
+    return [q/a, c/q] if q != 0 else [0.]
+
+# Yields (u, direction) of step events of one tower for segment p0 -> p1
+def tower_events(l2, tx, ty, step_size, p0, p1):
+    qx, qy, z0 = p0[0]-tx, p0[1]-ty, p0[2]
+    dx, dy, dz = p1[0]-p0[0], p1[1]-p0[1], p1[2]-p0[2]
+    a = dx*dx + dy*dy
+    b = qx*dx + qy*dy
+    s0 = l2 - qx*qx - qy*qy
+
+    def height(u):
+        return z0 + u*dz + math.sqrt(l2 - (qx+u*dx)**2 - (qy+u*dy)**2)
+
+    # top of h(u), from dz*sqrt(S(u)) = b + u*a
+    pieces = [(0., 1.)]
+    if a > 0:
+        disc = b*b - a*(b*b - dz*dz*s0)/(a + dz*dz)
+        if disc >= 0:
+            top = (-b + math.copysign(math.sqrt(disc), dz if dz != 0 else 1.)) / a
+            if 0 < top < 1 and (b + top*a)*dz >= 0:
+                pieces = [(0., top), (top, 1.)]
+
+    for u0, u1 in pieces:
+        n0 = round(height(u0)/step_size)
+        n1 = round(height(u1)/step_size)
+        direction = 1 if n1 > n0 else -1
+        for n in range(n0, n1, direction):
+            c = (n + 0.5*direction)*step_size - z0
+            # (c - u*dz)^2 = S(u)
+            roots = quadratic_roots(a + dz*dz, 2*(b - dz*c), c*c - s0)
+            u = min(roots, key=lambda r: max(u0 - r, r - u1, 0.) + (0. if c - r*dz >= 0 else 1.))
+            yield min(max(u, u0), u1), direction
+
+# Yields (time, tower, direction) for every step of the move from current position to (x, y, z),
+# printer.tower_steps is updated before each event is yielded
+def segment_events(printer, start, end, feedrate, t0 = 0.):
+    length = math.sqrt(sum((e-s)**2 for s, e in zip(start, end)))
+    if length == 0:
+        return
+    duration = length / feedrate
+    g = printer.geometry
+    def timed(tower):
+        tx, ty = g.tower_xy[tower]
+        for u, direction in tower_events(g.lengths2[tower], tx, ty, g.step_size, start, end):
+            yield t0 + u*duration, tower, direction
+    for event in heapq.merge(timed(0), timed(1), timed(2)):
+        printer.tower_steps[event[1]] += event[2]
+        yield event
+
+# Yields (time, tower, direction) for every step of a sequence of (x, y, z, feedrate) moves
+def trajectory_events(printer, moves, start = (0., 0., 0.)):
+    printer.move(*start)
+    position = tuple(start)
+    t = 0.
+    for x, y, z, feedrate in moves:
+        end = (x, y, z)
+        yield from segment_events(printer, position, end, feedrate, t)
+        t += math.sqrt(sum((e-s)**2 for s, e in zip(position, end))) / feedrate
+        position = end
+
+def main():
+    parser = DeltaPrinter.argument_parser()
+    parser.description = 'Step events of a move sequence'
+    parser.add_argument('input',type=str,nargs='?',default=None,help='G-code file, - for stdin')
+    parser.add_argument('-m','--moves',type=str,default=None,help='Moves instead of G-code, semicolon separated x,y,z,feedrate in mm and mm/s')
+    parser.add_argument('-v','--verbose',action='store_true',help='Print every step event')
+    args = parser.parse_args()
+
+    printer = DeltaPrinter.from_args(args)
+    printer.home()
+
+    if args.moves:
+        moves = [tuple(float(v) for v in m.split(',')) for m in args.moves.split(';')]
+    else:
+        stream = sys.stdin if args.input in (None, '-') else open(args.input)
+        moves = read_moves(stream)
+
+    counts = [[0, 0], [0, 0], [0, 0]]
+    t = 0.
+    for t, tower, direction in trajectory_events(printer, moves):
+        counts[tower][direction > 0] += 1
+        if args.verbose:
+            print("{0:.6f},{1},{2}".format(t, tower, direction))
+
+    print("Duration: {0:.3f}s".format(t), file=sys.stderr)
+    for tower in [0, 1, 2]:
+        print("Tower {0}: {1} up, {2} down".format(tower, counts[tower][1], counts[tower][0]), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()